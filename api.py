@@ -0,0 +1,203 @@
+import argparse
+import contextlib
+import math
+from datetime import date
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse
+from starlette.routing import Route
+
+import metrics
+from bulk_quote import NUMBER_FIELDS, quote_row
+from currency_converter import get_rate_snapshot, get_snapshot_on, start_rate_refresher, stop_rate_refresher
+from encar import get_car_id, quote_listing
+from encar_client import CatalogError
+from listing_store import load_listing
+from quote_cache import cached_customs_clearance, quote_cache
+from tariffs import get_schedule, start_schedule_watcher, stop_schedule_watcher
+
+# Максимальное количество авто в одном пакетном запросе
+MAX_BATCH_SIZE = 10_000
+
+
+def _error(message, status_code=400):
+    return JSONResponse({"error": message}, status_code=status_code)
+
+
+def _snapshot_or_error():
+    snapshot = get_rate_snapshot()
+    if snapshot is None:
+        return None, _error("Не удалось получить курсы валют", 503)
+    return snapshot, None
+
+
+def _is_finite(value):
+    """Ложь для nan, inf и чисел вне диапазона float; остальные ошибки значений разбирает quote_row"""
+    try:
+        return math.isfinite(float(value))
+    except OverflowError:
+        return False
+    except (TypeError, ValueError):
+        return True
+
+
+async def _json_body(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+async def health(request):
+    snapshot = get_rate_snapshot()
+    return JSONResponse({
+        "status": "ok" if snapshot is not None else "no_rates",
+        "rates_version": snapshot.version if snapshot is not None else None,
+        "tariffs_version": get_schedule().version,
+        "quote_cache": quote_cache.stats(),
+    })
+
+
+async def quote(request):
+    """
+    POST /quote - расчет растаможки для одного авто.
+
+    Тело - объект с полями как в bulk_quote.quote_row: price, currency,
+    engine_volume, engine_power, car_age или year_month, fuel_type,
+    is_electric, is_legal_entity, is_commercial.
+    """
+    row = await _json_body(request)
+    if not isinstance(row, dict):
+        return _error("Ожидается JSON-объект")
+    if not isinstance(row.get("currency") or "", str):
+        return _error("Поле currency должно быть кодом валюты (строкой)")
+    if not all(_is_finite(row.get(field)) for field in NUMBER_FIELDS):
+        return _error("Числовые поля должны быть конечными числами")
+    snapshot, error = _snapshot_or_error()
+    if error:
+        return error
+    result = quote_row(row, snapshot, cached_customs_clearance)
+    if result["error"]:
+        return _error(result["error"], 422)
+    del result["error"]
+    return JSONResponse(result)
+
+
+def _quote_batch(rows, snapshot):
+    return [quote_row(row, snapshot, cached_customs_clearance) if isinstance(row, dict)
+            else {"error": "Ожидается JSON-объект"} for row in rows]
+
+
+async def quote_batch(request):
+    """POST /quote/batch - {"items": [...]}, результаты в том же порядке"""
+    body = await _json_body(request)
+    items = body.get("items") if isinstance(body, dict) else None
+    if not isinstance(items, list):
+        return _error('Ожидается объект {"items": [...]}')
+    if len(items) > MAX_BATCH_SIZE:
+        return _error(f"Не более {MAX_BATCH_SIZE} авто в одном запросе", 413)
+    snapshot, error = _snapshot_or_error()
+    if error:
+        return error
+    # Большие пакеты считаются в пуле потоков, чтобы не задерживать остальные запросы
+    if len(items) > 100:
+        results = await run_in_threadpool(_quote_batch, items, snapshot)
+    else:
+        results = _quote_batch(items, snapshot)
+    return JSONResponse({"rates_version": snapshot.version, "items": results})
+
+
+async def convert(request):
+    """GET /convert?amount=...&from=...&to=...[&on_date=YYYY-MM-DD]"""
+    params = request.query_params
+    try:
+        amount = float(params["amount"])
+        from_currency = params["from"].upper()
+        to_currency = params.get("to", "RUB").upper()
+    except (KeyError, ValueError):
+        return _error("Нужны параметры amount, from и to")
+    if not math.isfinite(amount):
+        return _error("Параметр amount должен быть конечным числом")
+    on_date = params.get("on_date")
+    if on_date is not None:
+        try:
+            on_date = date.fromisoformat(on_date)
+        except ValueError:
+            return _error("Параметр on_date должен быть датой в формате YYYY-MM-DD")
+    snapshot = get_snapshot_on(on_date)
+    if snapshot is None:
+        return _error("Нет курсов валют" + (f" на {on_date}" if on_date else ""), 503)
+    try:
+        result = snapshot.convert(amount, from_currency, to_currency)
+    except KeyError as e:
+        return _error(f"Валюта {e} не найдена", 422)
+    if not math.isfinite(result):
+        return _error("Сумма вне допустимого диапазона", 422)
+    return JSONResponse({"amount": amount, "from": from_currency, "to": to_currency, "result": result,
+                         "rates_version": snapshot.version})
+
+
+async def encar(request):
+    """GET /encar?car=<ссылка на Encar или CAR_ID> - данные авто и расчет для себя и для перепродажи"""
+    car_id_json = get_car_id(request.query_params.get("car", ""))
+    if car_id_json["code"] == "error":
+        return _error(car_id_json["message"])
+    car_id = car_id_json["car_id"]
+    try:
+        listing = await run_in_threadpool(load_listing, car_id)
+    except CatalogError as e:
+        return _error(str(e), 502)
+    if listing is None:
+        return _error("Автомобиль с таким ID не найден", 404)
+    snapshot, error = _snapshot_or_error()
+    if error:
+        return error
+    try:
+        result = quote_listing(listing, snapshot)
+    except ValueError as e:
+        return _error(str(e), 422)
+    return JSONResponse({"car_id": car_id, "listing": listing.as_dict(), "quote": result,
+                         "rates_version": snapshot.version})
+
+
+async def metrics_endpoint(request):
+    """GET /metrics - метрики процесса в формате Prometheus"""
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    # Курсы загружаются до приема запросов и дальше обновляются в фоне
+    await run_in_threadpool(get_rate_snapshot)
+    start_rate_refresher()
+    start_schedule_watcher()
+    yield
+    stop_schedule_watcher()
+    stop_rate_refresher()
+
+
+app = Starlette(
+    routes=[
+        Route("/health", health),
+        Route("/quote", quote, methods=["POST"]),
+        Route("/quote/batch", quote_batch, methods=["POST"]),
+        Route("/convert", convert),
+        Route("/encar", encar),
+        Route("/metrics", metrics_endpoint),
+    ],
+    lifespan=lifespan,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HTTP API калькулятора растаможки")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8600)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
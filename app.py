@@ -1,299 +1,395 @@
-import json
-from datetime import datetime
-from currency_converter import convert_currency
-import streamlit as st
-import requests
-from config import calculate_customs_clearance, get_car_age
-
-st.set_page_config(page_title='Таможенный калькулятор', page_icon='🚗')
-hide_menu_style = """
-        <style>
-        #MainMenu {visibility: hidden;}
-        </style>
-        <script>
-        setInterval(function() {
-            fetch(window.location.href);
-        }, 5 * 60 * 1000);
-        </script>
-        """
-st.markdown(hide_menu_style, unsafe_allow_html=True)
-
-st.header('Калькулятор растаможки авто')
-
-FUEL_TYPES = {
-    '001': 'Бензин',
-    '002': 'Дизель',
-    '003': 'Сжиженный газ',
-    '005': 'Бензин + сжиженный газ',
-    '006': 'Бензин + Электричество',
-    '007': 'Дизель + Электричество',
-    '009': 'Электричество',
-}
-FUTURE_OWNER = [
-    "Физическое лицо",
-    "Юридическое лицо"
-]
-CURRENCIES = {
-    'Евро': 'EUR',
-    'Доллар': 'USD',
-    'Корейская вона': 'KRW',
-    'Российский рубль': 'RUB'
-}
-MONTHS = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь", "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь",
-          "Декабрь"]
-main_url = 'http://45.90.216.240:3051/'
-url2 = main_url + 'catalog.json'
-icon_error = ':material/error_outline:'
-is_calc_encar = False
-
-
-def eur_to_rub():
-    return convert_currency(1, 'EUR', 'RUB')
-
-
-@st.cache_data(ttl=84600)
-def load_json(url) -> json:
-    dt = requests.get(url)
-    return dt.json()
-
-
-def get_car_id(url):
-    if len(url) == 8 and url.isdigit():
-        return {
-            'code': 'ok',
-            'car_id': url
-        }
-    if (8 < len(url) or len(url) < 8) and url.isdigit():
-        return {
-            'code': 'error',
-            'message': f'CAR_ID должен содержать 8 символов. Сейчас их - {len(url)}'
-        }
-    k = url.split('detail/')
-    if len(k) != 2:
-        return {
-            'code': 'error',
-            'message': 'Неверный формат ссылки (отсутствует "detail/")'
-        }
-    j = k[1]
-    j = j[0:8]
-    if len(j) == 8:
-        return {
-            'code': 'ok',
-            'car_id': j
-        }
-    return {
-        'code': 'error',
-        'message': f'Неизвестная ошибка. Отправьте разработчику:\n'
-                   f'{url}'
-    }
-
-
-def get_car_year(year: int):
-    year_now = datetime.now().year
-    return year_now - year
-
-
-is_legal_entity, is_commercial = False, False
-
-if st.checkbox('Хочу посчитать машину с Encar'):
-    is_calc_encar = True
-    with st.container():
-        input_link = st.text_input('Вставьте ссылку на Encar или id авто')
-        if st.button('Найти'):
-            car_id = ''
-            id_car_json = get_car_id(input_link)
-            if id_car_json['code'] == 'error':
-                st.error(id_car_json['message'], icon=icon_error)
-                st.stop()
-            else:
-                car_id = id_car_json['car_id']
-            if not car_id:
-                st.error('CAR_ID не может быть пустым', icon=icon_error)
-                st.stop()
-            data = load_json(f'http://45.90.216.240:3051/catalog?car={car_id}')
-            if data.get('code') == 404:
-                st.error('Автомобиль с таким ID не найден!', icon=icon_error)
-                st.stop()
-            # ---------- print json -------------
-            # st.write(data)
-            # -------------------------------
-            group_car_data = data['vehicle']['category']
-            car_manufactory = group_car_data['manufacturerEnglishName']
-            car_model = group_car_data['modelGroupEnglishName']
-            car_name = group_car_data['gradeEnglishName']
-            car_yearmonth = group_car_data['yearMonth']
-            car_year = car_yearmonth[0:4]
-            car_month = int(car_yearmonth[4:])
-            car_month_word = MONTHS[car_month - 1]
-            car_price = int(data['vehicle']['advertisement']['price']) * 10000
-            car_displacement = data['vehicle']['spec']['displacement']
-            car_type = data['vehicle']['spec']["fuelCd"]
-            car_photos_path = data['vehicle']['photos'][0]['path']
-            car_photo = 'https://ci.encar.com/carpicture' + car_photos_path[0:-7] + '001.jpg' + \
-                        '?impolicy=heightRate&rh=696&cw=1160&ch=696&cg=Center '
-            if car_type == '009':
-                color = 'green'
-            else:
-                color = 'orange'
-            fuel_type = FUEL_TYPES[car_type]
-            st.markdown('#### Найден автомобиль:')
-            col1, col2, col3 = st.columns(3)
-            car_price_in_rub = convert_currency(car_price, 'KRW', 'RUB')
-            with col1:
-                st.write(f"Марка:&nbsp;&nbsp;&nbsp;:orange[{car_manufactory}]")
-                st.write(f"Модель:&nbsp;&nbsp;&nbsp;:orange[{car_model} {car_name}]")
-                st.write(f"Тип двигателя:&nbsp;&nbsp;&nbsp;:orange[{fuel_type}]")
-            with col2:
-                st.write(f"Объем / Л.С.:&nbsp;&nbsp;&nbsp;:{color}[{car_displacement}]")
-                st.write(f"Дата выпуска:&nbsp;&nbsp;&nbsp;:orange[{car_month_word} {car_year}]")
-                formatted_number = f"₩ {car_price:,}"
-                formatted_car_in_rub = "{:,.0f}".format(car_price_in_rub).replace(",", " ")
-                st.write(
-                    f"Цена:&nbsp;&nbsp;&nbsp;:orange[{formatted_number}]&nbsp;|&nbsp;:gray[{formatted_car_in_rub} ₽]")
-            with col3:
-                st.image(car_photo, width=300)
-            # st.write(car_photo)
-            # --------------- Расчет авто ----------------------------
-            st.markdown('#### Расчет таможенных платежей:')
-            engine_volume = car_displacement
-            # ----- Электричка ---------
-            if car_type == '009':
-                is_electric = True
-                engine_power = car_displacement
-            else:
-                is_electric = False
-                engine_power = 170
-                if car_type == '002':
-                    fuel_type = 2
-            data = get_car_age(car_yearmonth)
-            car_age = data['year']
-            is_eligible = data['is_eligible']
-            txt = ':green[Автомобиль проходной]' if is_eligible else ':red[Автомобиль непроходной]'
-            # st.write(car_age, type(car_age))
-            st.write(txt)
-            calc_is_legal = calculate_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power,
-                                                        is_electric,
-                                                        is_legal_entity, is_commercial, fuel_type, eur_to_rub())
-            calc_not_legal = calculate_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power,
-                                                         is_electric,
-                                                         is_legal_entity, True, fuel_type, eur_to_rub())
-            # formatted_value = "{:,.0f}".format(value).replace(",", " ")
-            # st.write(f"{key}&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[ {formatted_value} руб.]")
-            customs_clearance = calc_is_legal['Таможенное оформление']
-            custom_duty = calc_is_legal['Таможенная пошлина']
-            util1 = calc_is_legal['Утилизационный сбор']
-            util2 = calc_not_legal['Утилизационный сбор']
-            tax = calc_is_legal['Акциз']
-            vat = calc_is_legal['НДС']
-            summary1 = calc_is_legal['Итоговая стоимость растаможки']
-            summary2 = calc_not_legal['Итоговая стоимость растаможки']
-            formatted_value = "{:,.0f}".format(customs_clearance).replace(",", " ")
-            st.write(f'Таможенное оформление&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value} руб.]')
-            formatted_value = "{:,.0f}".format(custom_duty).replace(",", " ")
-            st.write(f'Таможенная пошлина&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value} руб.]')
-            formatted_value = "{:,.0f}".format(util1).replace(",", " ")
-            formatted_value2 = "{:,.0f}".format(util2).replace(",", " ")
-            st.write(
-                f'Утилизационный сбор&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value} руб.] / :red[{formatted_value2} руб.]')
-            if tax != 0:
-                formatted_value = "{:,.0f}".format(tax).replace(",", " ")
-                st.write(f'Акциз&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value} руб.]')
-            if vat != 0:
-                formatted_value = "{:,.0f}".format(vat).replace(",", " ")
-                st.write(f'НДС&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value} руб.]')
-            formatted_itog1 = "{:,.0f}".format(summary1).replace(",", " ")
-            formatted_itog2 = "{:,.0f}".format(summary2).replace(",", " ")
-            st.write(f'Итоговая стоимость растаможки&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green['
-                     f'{formatted_itog1} руб.] / :red[{formatted_itog2} руб.]')
-            frm_it1 = "{:,.0f}".format(summary1 + car_price_in_rub).replace(",", " ")
-            frm_it2 = "{:,.0f}".format(summary2 + car_price_in_rub).replace(",", " ")
-            st.write(f'Итого (для себя):&nbsp;&nbsp;&nbsp;:orange[{frm_it1}] :gray[₽ &nbsp;&nbsp;&nbsp;&nbsp;'
-                     f'{formatted_car_in_rub}₽ + {formatted_itog1}₽]')
-            st.write(f'Итого (перепродажа):&nbsp;&nbsp;&nbsp;:orange[{frm_it2}] :gray[₽ &nbsp;&nbsp;&nbsp;&nbsp;'
-                     f'{formatted_car_in_rub}₽ + {formatted_itog2}₽]')
-
-            st.divider()
-else:
-    is_calc_encar = False
-
-if not is_calc_encar:
-    with st.container():
-        owner = st.selectbox(label='Автомобиль ввозит',
-                             options=FUTURE_OWNER, index=0,
-                             help='Критерии личного использования:\n- машина остается в собственности '
-                                  'физлица, который её привёз не менее года;\n- физическое лицо ввозит '
-                                  'не более одной машины в год;\n- объем двигателя автомобиля не более '
-                                  '3 л.\n\nЕсли автомобиль не попадает под критерии личного использования, '
-                                  'то применяются повышенные коэффициенты утилизационного сбора')
-        # if owner == FUTURE_OWNER[1]:
-        #     is_commercial = True
-        if owner == FUTURE_OWNER[1]:
-            is_legal_entity = True
-        # st.write(owner)
-        car_year = st.selectbox('Год выпуска авто', [2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023, 2024, 2025], 5)
-        car_age = get_car_year(car_year)
-        # ['Бензиновый', 'Дизельный', 'Гибридный', 'Электрический']
-        engine_type = st.selectbox('Тип двигателя', ['Бензиновый', 'Дизельный', 'Гибридный', 'Электрический'], 1)
-        # st.write(engine_type)
-        if engine_type in ['Бензиновый', 'Гибридный']:
-            fuel_type = 1
-        else:
-            fuel_type = 2
-        is_electric = True if engine_type == 'Электрический' else False
-        # st.write('mortgage')
-        engine_power = st.number_input('Мощность двигателя (ЛС)', 50, 1000, 170, disabled=not is_electric)
-        engine_volume = st.number_input('Объем двигателя (см³)', 500, 6000, 2199, disabled=is_electric)
-        col1, col2, col3 = st.columns([2, 1, 1], vertical_alignment='bottom')
-        with col1:
-            car_price = st.number_input('Стоимость автомобиля', 100, 100_000_000, 20_000)
-        with col2:
-            price_curr = st.selectbox('Валюта', CURRENCIES.keys(), 0)
-        with col3:
-            curr_to = 'RUB'
-            curr_from = CURRENCIES[price_curr]
-            # car_price_in_rub = converter.convert(car_price, curr_from, curr_to, 'CBR')
-            car_price_in_rub = convert_currency(car_price, curr_from, curr_to)
-            formatted_car_price_in_rub = "{:,.0f}".format(car_price_in_rub).replace(",", ".")
-            st.write(f"&nbsp;&nbsp;:gray[= {formatted_car_price_in_rub} ₽]")
-
-        if st.button('Рассчитать'):
-            st.write(f':gray[1 EUR - {eur_to_rub()} ₽]')
-            if owner == FUTURE_OWNER[1]:
-                data = calculate_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power, is_electric,
-                                                   is_legal_entity, is_commercial, fuel_type, eur_to_rub())
-                for key, value in data.items():
-                    if value == 0:
-                        continue
-                    formatted_value = "{:,.0f}".format(value).replace(",", " ")
-                    st.write(f"{key}&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[ {formatted_value} руб.]")
-            else:
-                data1 = calculate_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power, is_electric,
-                                                    False, False, fuel_type, eur_to_rub())
-                data2 = calculate_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power, is_electric,
-                                                    False, True, fuel_type, eur_to_rub())
-                s = data1["Таможенное оформление"]
-                formatted_value = "{:,.0f}".format(s).replace(",", " ")
-                st.write(f"Таможенное оформление&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[ {formatted_value} руб.]")
-                s = data1["Таможенная пошлина"]
-                formatted_value = "{:,.0f}".format(s).replace(",", " ")
-                st.write(f"Таможенная пошлина&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[ {formatted_value} руб.]")
-                s1 = data1["Утилизационный сбор"]
-                s2 = data2["Утилизационный сбор"]
-                formatted_value1 = "{:,.0f}".format(s1).replace(",", " ")
-                formatted_value2 = "{:,.0f}".format(s2).replace(",", " ")
-                st.write(f'Утилизационный сбор&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value1} руб.] / '
-                         f':red[{formatted_value2} руб.]')
-                tax = data1["Акциз"]
-                if tax != 0:
-                    formatted_value = "{:,.0f}".format(tax).replace(",", " ")
-                    st.write(f'Акциз&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value} руб.]')
-                vat = data1["НДС"]
-                if vat != 0:
-                    formatted_value = "{:,.0f}".format(vat).replace(",", " ")
-                    st.write(f'НДС&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{formatted_value} руб.]')
-                s1 = data1["Итоговая стоимость растаможки"]
-                s2 = data2["Итоговая стоимость растаможки"]
-                formatted_value1 = "{:,.0f}".format(s1).replace(",", " ")
-                formatted_value2 = "{:,.0f}".format(s2).replace(",", " ")
-                st.write(f'Итоговая стоимость растаможки&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green['
-                         f'{formatted_value1} руб.]  / :red[{formatted_value2} руб.]')
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime
+from currency_converter import get_rate_snapshot
+import streamlit as st
+from encar import FUEL_TYPES, get_car_id, photo_url, prefetch_photo, quote_listing, quote_listings
+from encar_client import CATALOG_URL, CONCURRENCY, CatalogError
+from listing_store import load_listing
+from quote_cache import cached_customs_clearance
+from tariffs import get_schedule, start_schedule_watcher
+import metrics
+
+st.set_page_config(page_title='Таможенный калькулятор', page_icon='🚗')
+metrics.start_metrics_server()
+# Новые версии тарифов подхватываются без перезапуска (повторный вызов ничего не делает)
+start_schedule_watcher()
+hide_menu_style = """
+        <style>
+        #MainMenu {visibility: hidden;}
+        </style>
+        <script>
+        setInterval(function() {
+            fetch(window.location.href);
+        }, 5 * 60 * 1000);
+        </script>
+        """
+st.markdown(hide_menu_style, unsafe_allow_html=True)
+
+st.header('Калькулятор растаможки авто')
+
+FUTURE_OWNER = [
+    "Физическое лицо",
+    "Юридическое лицо"
+]
+CURRENCIES = {
+    'Евро': 'EUR',
+    'Доллар': 'USD',
+    'Корейская вона': 'KRW',
+    'Российский рубль': 'RUB'
+}
+MONTHS = ["Январь", "Февраль", "Март", "Апрель", "Май", "Июнь", "Июль", "Август", "Сентябрь", "Октябрь", "Ноябрь",
+          "Декабрь"]
+main_url = CATALOG_URL
+url2 = main_url + 'catalog.json'
+icon_error = ':material/error_outline:'
+# Сколько авто можно сравнить за один раз
+MAX_COMPARE = 20
+
+
+def fmt(value, separator=" "):
+    return "{:,.0f}".format(value).replace(",", separator)
+
+
+def compute_once(name, key, compute, keep=None):
+    """
+    Результат compute() из st.session_state: пересчитывается, только если
+    изменился key (входные данные и версии курсов и тарифов), а не на каждый перезапуск.
+
+    Если keep(результат) ложно (например, каталог был недоступен), результат
+    не запоминается: следующее нажатие кнопки посчитает его заново.
+    """
+    cached = st.session_state.get(name)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    value = compute()
+    if keep is None or keep(value):
+        st.session_state[name] = (key, value)
+    else:
+        st.session_state.pop(name, None)
+    return value
+
+
+def data_version(snapshot):
+    """Версии исходных данных расчета: курсов и действующих тарифов"""
+    return snapshot.version, get_schedule().version
+
+
+def get_car_year(year: int):
+    year_now = datetime.now().year
+    return year_now - year
+
+
+def price_sweep(car_price, currency, engine_volume, car_age, engine_power, is_electric, is_legal_entity, fuel_type):
+    """Точки графика итога от цены и строки со скачками итога"""
+    # numpy (через sensitivity) загружается с первым графиком, а не при открытии страницы
+    from sensitivity import PRICE, sweep_total
+
+    # Итог считается по участкам между границами скобок тарифов, поэтому график строится мгновенно
+    sweep = sweep_total(PRICE, car_price * 0.5, car_price * 2, car_price, currency, engine_volume, car_age,
+                        engine_power, is_electric, is_legal_entity, False, fuel_type)
+    points = sweep.points()
+    chart = {'Цена': [x for x, _ in points], 'Итого, ₽': [y for _, y in points]}
+    cliffs = []
+    for breakpoint in sweep.breakpoints:
+        if abs(breakpoint.jump) >= 1:
+            formatted_jump = "{:+,.0f}".format(breakpoint.jump).replace(",", " ")
+            cliffs.append(f'Цена {fmt(breakpoint.x)} {currency}&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;'
+                          f':red[скачок итога {formatted_jump} ₽]')
+    return chart, cliffs
+
+
+def manual_quote_lines(car_price_in_rub, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                       is_commercial, fuel_type, eur_rate):
+    """Строки результата ручного расчета"""
+    lines = [f':gray[1 EUR - {eur_rate} ₽]']
+    if is_legal_entity:
+        with metrics.timed('compute'):
+            data = cached_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power, is_electric,
+                                            is_legal_entity, is_commercial, fuel_type, eur_rate)
+        for key, value in data.items():
+            if value == 0:
+                continue
+            lines.append(f"{key}&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[ {fmt(value)} руб.]")
+        return lines
+
+    with metrics.timed('compute'):
+        data1 = cached_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power, is_electric, False,
+                                         False, fuel_type, eur_rate)
+        data2 = cached_customs_clearance(car_price_in_rub, engine_volume, car_age, engine_power, is_electric, False,
+                                         True, fuel_type, eur_rate)
+    lines.append(f"Таможенное оформление&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[ "
+                 f"{fmt(data1['Таможенное оформление'])} руб.]")
+    lines.append(f"Таможенная пошлина&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[ "
+                 f"{fmt(data1['Таможенная пошлина'])} руб.]")
+    lines.append(f"Утилизационный сбор&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(data1['Утилизационный сбор'])} "
+                 f"руб.] / :red[{fmt(data2['Утилизационный сбор'])} руб.]")
+    tax = data1["Акциз"]
+    if tax != 0:
+        lines.append(f'Акциз&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(tax)} руб.]')
+    vat = data1["НДС"]
+    if vat != 0:
+        lines.append(f'НДС&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(vat)} руб.]')
+    lines.append(f'Итоговая стоимость растаможки&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green['
+                 f'{fmt(data1["Итоговая стоимость растаможки"])} руб.]  / '
+                 f':red[{fmt(data2["Итоговая стоимость растаможки"])} руб.]')
+    return lines
+
+
+def encar_quote(car_id, snapshot):
+    """Карточка авто и расчет для нее; None или текст ошибки, если расчет невозможен"""
+    try:
+        with metrics.timed('catalog_fetch'):
+            listing = load_listing(car_id)
+    except CatalogError:
+        return None, 'Каталог Encar сейчас недоступен, попробуйте позже'
+    if listing is None:
+        return None, 'Автомобиль с таким ID не найден!'
+    # Сервис фотографий загружает фото, пока считается растаможка
+    prefetch_photo(listing.photo_path)
+    with metrics.timed('compute'):
+        quote = quote_listing(listing, snapshot)
+    return (listing, quote), None
+
+
+def show_encar_result(listing, quote):
+    car_yearmonth = listing.year_month
+    car_year = car_yearmonth[0:4]
+    car_month_word = MONTHS[int(car_yearmonth[4:]) - 1]
+    car_type = listing.fuel_code
+    color = 'green' if car_type == '009' else 'orange'
+    car_price_in_rub = quote['price_rub']
+    formatted_car_in_rub = fmt(car_price_in_rub)
+    st.markdown('#### Найден автомобиль:')
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.write(f"Марка:&nbsp;&nbsp;&nbsp;:orange[{listing.manufacturer}]")
+        st.write(f"Модель:&nbsp;&nbsp;&nbsp;:orange[{listing.model} {listing.grade}]")
+        st.write(f"Тип двигателя:&nbsp;&nbsp;&nbsp;:orange[{FUEL_TYPES[car_type]}]")
+    with col2:
+        st.write(f"Объем / Л.С.:&nbsp;&nbsp;&nbsp;:{color}[{listing.displacement}]")
+        st.write(f"Дата выпуска:&nbsp;&nbsp;&nbsp;:orange[{car_month_word} {car_year}]")
+        st.write(f"Цена:&nbsp;&nbsp;&nbsp;:orange[₩ {listing.price_krw:,}]&nbsp;|&nbsp;:gray[{formatted_car_in_rub} ₽]")
+    with col3:
+        with metrics.timed('image'):
+            st.image(photo_url(listing.photo_path), width=300)
+    # --------------- Расчет авто ----------------------------
+    st.markdown('#### Расчет таможенных платежей:')
+    st.write(':green[Автомобиль проходной]' if quote['is_eligible'] else ':red[Автомобиль непроходной]')
+    personal = quote['personal']
+    resale = quote['resale']
+    summary1 = personal['Итоговая стоимость растаможки']
+    summary2 = resale['Итоговая стоимость растаможки']
+    st.write(f'Таможенное оформление&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(personal["Таможенное оформление"])} руб.]')
+    st.write(f'Таможенная пошлина&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(personal["Таможенная пошлина"])} руб.]')
+    st.write(f'Утилизационный сбор&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(personal["Утилизационный сбор"])} руб.] / '
+             f':red[{fmt(resale["Утилизационный сбор"])} руб.]')
+    if personal['Акциз'] != 0:
+        st.write(f'Акциз&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(personal["Акциз"])} руб.]')
+    if personal['НДС'] != 0:
+        st.write(f'НДС&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green[{fmt(personal["НДС"])} руб.]')
+    st.write(f'Итоговая стоимость растаможки&nbsp;&nbsp;&nbsp;-&nbsp;&nbsp;&nbsp;:green['
+             f'{fmt(summary1)} руб.] / :red[{fmt(summary2)} руб.]')
+    st.write(f'Итого (для себя):&nbsp;&nbsp;&nbsp;:orange[{fmt(quote["total_personal"])}] :gray[₽ &nbsp;&nbsp;&nbsp;&nbsp;'
+             f'{formatted_car_in_rub}₽ + {fmt(summary1)}₽]')
+    st.write(f'Итого (перепродажа):&nbsp;&nbsp;&nbsp;:orange[{fmt(quote["total_resale"])}] :gray[₽ &nbsp;&nbsp;&nbsp;&nbsp;'
+             f'{formatted_car_in_rub}₽ + {fmt(summary2)}₽]')
+    st.divider()
+
+
+def parse_car_ids(text):
+    """CAR_ID из списка ссылок или id (по одному в строке) без повторов и ошибки разбора"""
+    car_ids, errors = [], []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        id_car_json = get_car_id(line)
+        if id_car_json['code'] == 'error':
+            errors.append(f"{line}: {id_car_json['message']}")
+        elif id_car_json['car_id'] not in car_ids:
+            car_ids.append(id_car_json['car_id'])
+    return car_ids, errors
+
+
+def comparison_row(car_id, listing, quote):
+    car_yearmonth = listing.year_month
+    return {
+        'CAR_ID': car_id,
+        'Авто': f'{listing.manufacturer} {listing.model} {listing.grade}',
+        'Дата выпуска': f'{MONTHS[int(car_yearmonth[4:]) - 1]} {car_yearmonth[0:4]}',
+        'Двигатель': FUEL_TYPES.get(listing.fuel_code, listing.fuel_code),
+        'Проходной': quote['is_eligible'],
+        'Цена, ₽': round(quote['price_rub']),
+        'Итого (для себя), ₽': round(quote['total_personal']),
+        'Итого (перепродажа), ₽': round(quote['total_resale']),
+    }
+
+
+def show_comparison(placeholder, rows):
+    """Таблица сравнения, отсортированная по итогу для себя (сортировка по клику на заголовок)"""
+    ranked = sorted(rows, key=lambda row: row['Итого (для себя), ₽'])
+    placeholder.dataframe([{'№': place, **row} for place, row in enumerate(ranked, 1)], hide_index=True,
+                          column_config={'CAR_ID': st.column_config.TextColumn(),
+                                         'Проходной': st.column_config.CheckboxColumn()})
+
+
+def compare_listings(car_ids, snapshot, placeholder):
+    """
+    Загружает карточки параллельно и дополняет таблицу по мере их получения.
+
+    Карточки, пришедшие к моменту очередного обновления, считаются одним
+    пакетом (quote_listings), поэтому таблица не ждет самого медленного ответа.
+
+    :return: (строки таблицы, [(CAR_ID, текст ошибки)])
+    """
+    rows, failed = [], []
+    with ThreadPoolExecutor(max_workers=min(CONCURRENCY, len(car_ids))) as pool:
+        pending = {pool.submit(load_listing, car_id): car_id for car_id in car_ids}
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            arrived = []
+            for future in done:
+                car_id = pending.pop(future)
+                try:
+                    listing = future.result()
+                except CatalogError:
+                    failed.append((car_id, 'каталог Encar сейчас недоступен'))
+                    continue
+                except (KeyError, IndexError, TypeError, ValueError):
+                    # parse_listing: в карточке нет нужных полей (например, фотографий)
+                    failed.append((car_id, 'некорректная карточка в каталоге Encar'))
+                    continue
+                if listing is None:
+                    failed.append((car_id, 'автомобиль с таким ID не найден'))
+                    continue
+                arrived.append((car_id, listing))
+            if not arrived:
+                continue
+            with metrics.timed('compute'):
+                quotes = quote_listings([listing for _, listing in arrived], snapshot)
+            for (car_id, listing), quote in zip(arrived, quotes):
+                if isinstance(quote, Exception):
+                    failed.append((car_id, str(quote)))
+                    continue
+                rows.append(comparison_row(car_id, listing, quote))
+            show_comparison(placeholder, rows)
+    return rows, failed
+
+
+# Каждый раздел - отдельный фрагмент: изменение поля перезапускает только свой раздел
+@st.fragment
+def encar_calculator():
+    with metrics.timed('render_encar'), st.container():
+        input_link = st.text_input('Вставьте ссылку на Encar или id авто')
+        if not st.button('Найти'):
+            return
+        id_car_json = get_car_id(input_link)
+        if id_car_json['code'] == 'error':
+            st.error(id_car_json['message'], icon=icon_error)
+            return
+        car_id = id_car_json['car_id']
+        if not car_id:
+            st.error('CAR_ID не может быть пустым', icon=icon_error)
+            return
+        snapshot = get_rate_snapshot()
+        if snapshot is None:
+            st.error('Не удалось получить курсы валют. Попробуйте позже.', icon=icon_error)
+            return
+        # Ошибки каталога не запоминаются: после сбоя повторное нажатие загружает авто заново
+        result, error = compute_once('encar_quote', (car_id, data_version(snapshot)),
+                                     lambda: encar_quote(car_id, snapshot), keep=lambda value: value[1] is None)
+        if error:
+            st.error(error, icon=icon_error)
+            return
+        show_encar_result(*result)
+
+
+@st.fragment
+def encar_comparison():
+    with metrics.timed('render_compare'), st.container():
+        input_links = st.text_area(f'Ссылки на Encar или id авто, по одной в строке (до {MAX_COMPARE})')
+        if not st.button('Сравнить'):
+            return
+        car_ids, errors = parse_car_ids(input_links)
+        for error in errors:
+            st.error(error, icon=icon_error)
+        if not car_ids:
+            if not errors:
+                st.error('Добавьте хотя бы одну ссылку или id авто', icon=icon_error)
+            return
+        if len(car_ids) > MAX_COMPARE:
+            st.warning(f'Сравниваются первые {MAX_COMPARE} авто из {len(car_ids)}')
+            car_ids = car_ids[:MAX_COMPARE]
+        snapshot = get_rate_snapshot()
+        if snapshot is None:
+            st.error('Не удалось получить курсы валют. Попробуйте позже.', icon=icon_error)
+            return
+        st.markdown('#### Сравнение по итоговой стоимости:')
+        placeholder = st.empty()
+        # Сравнение с ошибками не запоминается: "Сравнить" заново загрузит не найденные и недоступные авто
+        rows, failed = compute_once('encar_comparison', (tuple(car_ids), data_version(snapshot)),
+                                    lambda: compare_listings(car_ids, snapshot, placeholder),
+                                    keep=lambda value: not value[1])
+        if rows:
+            show_comparison(placeholder, rows)
+        for car_id, error in failed:
+            st.error(f'{car_id}: {error}', icon=icon_error)
+
+
+@st.fragment
+def manual_calculator():
+    with metrics.timed('render_manual'), st.container():
+        owner = st.selectbox(label='Автомобиль ввозит',
+                             options=FUTURE_OWNER, index=0,
+                             help='Критерии личного использования:\n- машина остается в собственности '
+                                  'физлица, который её привёз не менее года;\n- физическое лицо ввозит '
+                                  'не более одной машины в год;\n- объем двигателя автомобиля не более '
+                                  '3 л.\n\nЕсли автомобиль не попадает под критерии личного использования, '
+                                  'то применяются повышенные коэффициенты утилизационного сбора')
+        is_legal_entity = owner == FUTURE_OWNER[1]
+        is_commercial = False
+        car_year = st.selectbox('Год выпуска авто', [2016, 2017, 2018, 2019, 2020, 2021, 2022, 2023, 2024, 2025], 5)
+        car_age = get_car_year(car_year)
+        # ['Бензиновый', 'Дизельный', 'Гибридный', 'Электрический']
+        engine_type = st.selectbox('Тип двигателя', ['Бензиновый', 'Дизельный', 'Гибридный', 'Электрический'], 1)
+        fuel_type = 1 if engine_type in ['Бензиновый', 'Гибридный'] else 2
+        is_electric = engine_type == 'Электрический'
+        engine_power = st.number_input('Мощность двигателя (ЛС)', 50, 1000, 170, disabled=not is_electric)
+        engine_volume = st.number_input('Объем двигателя (см³)', 500, 6000, 2199, disabled=is_electric)
+        col1, col2, col3 = st.columns([2, 1, 1], vertical_alignment='bottom')
+        with col1:
+            car_price = st.number_input('Стоимость автомобиля', 100, 100_000_000, 20_000)
+        with col2:
+            price_curr = st.selectbox('Валюта', CURRENCIES.keys(), 0)
+        snapshot = get_rate_snapshot()
+        if snapshot is None:
+            st.error('Не удалось получить курсы валют. Попробуйте позже.', icon=icon_error)
+            return
+        curr_from = CURRENCIES[price_curr]
+        car_price_in_rub = snapshot.convert(car_price, curr_from, 'RUB')
+        with col3:
+            st.write(f"&nbsp;&nbsp;:gray[= {fmt(car_price_in_rub, '.')} ₽]")
+
+        if st.button('Рассчитать'):
+            inputs = (car_price_in_rub, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                      is_commercial, fuel_type, snapshot.to_rub('EUR'))
+            lines = compute_once('manual_quote', (inputs, data_version(snapshot)), lambda: manual_quote_lines(*inputs))
+            for line in lines:
+                st.write(line)
+            with st.expander('Как итог зависит от цены авто'):
+                sweep_inputs = (car_price, curr_from, engine_volume, car_age, engine_power, is_electric,
+                                is_legal_entity, fuel_type)
+                chart, cliffs = compute_once('price_sweep', (sweep_inputs, data_version(snapshot)),
+                                             lambda: price_sweep(*sweep_inputs))
+                st.line_chart(chart, x='Цена', y='Итого, ₽')
+                for line in cliffs:
+                    st.write(line)
+
+
+if st.checkbox('Хочу посчитать машину с Encar'):
+    if st.toggle('Сравнить несколько авто'):
+        encar_comparison()
+    else:
+        encar_calculator()
+else:
+    manual_calculator()
@@ -0,0 +1,127 @@
+import numpy as np
+from config import FEE_KEYS, resolve_snapshot
+from tariffs import LEGAL_FUEL_TABLES, get_schedule
+
+
+def _bracket(x, table, column=None):
+    """Векторный выбор значения из скобок тарифа (x <= граница) бинарным поиском"""
+    values = np.asarray(table.values, dtype=float)
+    if column is not None:
+        values = values[:, column]
+    return values[np.searchsorted(table.bounds, x, side='left')]
+
+
+def calculate_customs_clearance_batch(car_price_rub, engine_volume, car_age, engine_power, is_electric,
+                                      is_legal_entity, is_commercial=False, fuel_type=1, exchange_rate=None,
+                                      schedule=None, on_date=None, price_eur=None):
+    """
+    Векторный расчет растаможки для массива автомобилей.
+
+    Принимает столбцы (массивы NumPy или списки одинаковой длины, скаляры
+    растягиваются на весь столбец) с теми же смыслами, что и
+    calculate_customs_clearance, и возвращает словарь с теми же ключами,
+    где каждое значение - массив сборов по всем автомобилям. Результаты
+    совпадают со скалярной функцией.
+
+    :param exchange_rate: Курс евро к рублю. Если не указан, берется из
+        текущего снимка курсов ЦБ (один раз на весь пакет)
+    :param schedule: Набор тарифов (по умолчанию действующий на дату on_date)
+    :param on_date: Дата декларирования: на нее берутся курсы ЦБ (из локальной истории курсов) и тарифы
+    :param price_eur: Цена в евро для выбора скобки пошлины физлиц младше 3 лет.
+        По умолчанию - цена в рублях по курсу евро из снимка курсов ЦБ
+    :return: Словарь {название сбора: np.ndarray}
+    """
+    price = np.asarray(car_price_rub, dtype=float)
+    shape = np.broadcast(price, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                         is_commercial, fuel_type).shape
+    price = np.broadcast_to(price, shape)
+    volume = np.broadcast_to(np.asarray(engine_volume, dtype=float), shape)
+    age = np.broadcast_to(np.asarray(car_age, dtype=float), shape)
+    power = np.broadcast_to(np.asarray(engine_power, dtype=float), shape)
+    electric = np.broadcast_to(np.asarray(is_electric, dtype=bool), shape)
+    legal = np.broadcast_to(np.asarray(is_legal_entity, dtype=bool), shape)
+    commercial = np.broadcast_to(np.asarray(is_commercial, dtype=bool), shape)
+    fuel = np.broadcast_to(np.asarray(fuel_type), shape)
+
+    # Курс евро и тарифы определяются один раз на весь пакет
+    schedule = schedule or get_schedule(on_date)
+    snapshot = None
+    if exchange_rate is None:
+        snapshot = resolve_snapshot(on_date)
+        exchange_rate = snapshot.to_rub("EUR")
+
+    is_new = age < 3
+    is_3_5 = (age >= 3) & (age <= 5)
+    is_3_7 = (age >= 3) & (age <= 7)
+
+    # 1. Сбор за таможенное оформление
+    customs_clearance_fee = _bracket(price, schedule.clearance_fee)
+
+    # 2. Таможенная пошлина
+    individual = ~electric & ~legal
+    individual_new = individual & is_new
+    if individual_new.any():
+        # Для физических лиц младше 3 лет ставка зависит от цены в евро
+        if price_eur is None:
+            if snapshot is None:
+                snapshot = resolve_snapshot(on_date)
+            price_eur = price / snapshot.to_rub("EUR")
+        new_table = schedule.individual_duty["new"]
+        duty_individual_new = np.maximum(
+            price * _bracket(price_eur, new_table, 0),
+            _bracket(price_eur, new_table, 1) * volume * exchange_rate)
+    else:
+        duty_individual_new = np.zeros(shape)
+    duty_individual = np.select(
+        [is_new, is_3_5],
+        [duty_individual_new,
+         _bracket(volume, schedule.individual_duty["3_5"]) * volume * exchange_rate],
+        _bracket(volume, schedule.individual_duty["old"]) * volume * exchange_rate)
+
+    duty_legal = {}
+    for fuel_name, tables in schedule.legal_duty.items():
+        duty_legal[fuel_name] = np.select(
+            [is_new, is_3_7],
+            [price * _bracket(volume, tables["new"]),
+             np.maximum(price * _bracket(volume, tables["3_7"], 0),
+                        _bracket(volume, tables["3_7"], 1) * volume * exchange_rate)],
+            _bracket(volume, tables["old"]) * volume * exchange_rate)
+
+    fuel_masks = [fuel == fuel_type_code for fuel_type_code in LEGAL_FUEL_TABLES]
+    unknown_fuel = ~electric & legal & ~np.logical_or.reduce(fuel_masks)
+    if unknown_fuel.any():
+        raise ValueError(f"Неизвестный тип топлива: {fuel[unknown_fuel][0]}")
+    customs_duty = np.select(
+        [electric, ~legal] + fuel_masks,
+        [price * schedule.electric_duty_rate, duty_individual]
+        + [duty_legal[fuel_name] for fuel_name in LEGAL_FUEL_TABLES.values()])
+
+    # 3. Утилизационный сбор
+    base_rate = np.where(legal, schedule.recycling_base["legal"], schedule.recycling_base["individual"])
+    commercial_rate = commercial | legal
+    commercial_tables = schedule.recycling["commercial"]
+    personal_tables = schedule.recycling["personal"]
+    coefficient = np.select(
+        [electric & commercial_rate & is_new, electric & commercial_rate,
+         electric & is_new, electric,
+         commercial_rate & is_new, commercial_rate,
+         is_new],
+        [commercial_tables["electric_new"], commercial_tables["electric_old"],
+         personal_tables["electric_new"], personal_tables["electric_old"],
+         _bracket(volume, commercial_tables["new"]),
+         _bracket(volume, commercial_tables["old"]),
+         _bracket(volume, personal_tables["new"])],
+        _bracket(volume, personal_tables["old"]))
+    recycling_fee = base_rate * coefficient
+
+    # 4. Акциз
+    taxable = legal | electric
+    excise_tax = np.where(taxable, _bracket(power, schedule.excise) * power, 0.0)
+
+    # 5. НДС (для юридических лиц или физических лиц, если электромобиль)
+    vat = np.where(taxable, (price + customs_duty + excise_tax) * schedule.vat_rate, 0.0)
+
+    # Итоговая стоимость растаможки
+    total_cost = customs_clearance_fee + customs_duty + recycling_fee + excise_tax + vat
+
+    return dict(zip(FEE_KEYS, (customs_clearance_fee, customs_duty, recycling_fee, excise_tax, vat, total_cost)))
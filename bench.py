@@ -0,0 +1,176 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import currency_converter
+from config import calculate_customs_clearance, get_car_age
+from encar import get_car_id, parse_listing, quote_listing
+from encar_client import CatalogClient
+from quote_cache import quote_cache
+from shared_rates import SharedRates
+from standins import catalog_server, load_fixture
+
+# Минимальное время измерения одного сценария (в секундах)
+MIN_TIME = 0.5
+MIN_ITERATIONS = 50
+# Допустимое падение ops/sec относительно базовых результатов
+REGRESSION_THRESHOLD = 0.15
+
+EUR_RATE = 94.2513
+
+# Ветки calculate_customs_clearance: (владелец, двигатель, возраст) -> параметры
+CALC_OWNERS = {"individual": False, "legal": True}
+CALC_ENGINES = {
+    # (объем, мощность, электро, тип топлива)
+    "petrol": (1998, 190, False, 1),
+    "diesel": (2199, 200, False, 2),
+    "electric": (0, 229, True, 1),
+}
+CALC_AGES = {"age1": 1, "age4": 4, "age6": 6, "age9": 9}
+
+
+def measure(func, min_time=MIN_TIME, min_iterations=MIN_ITERATIONS):
+    """Вызывает func, пока не наберется min_time секунд, и возвращает ops/sec и перцентили задержки"""
+    func()  # прогрев
+    latencies = []
+    perf_counter_ns = time.perf_counter_ns
+    deadline = time.perf_counter() + min_time
+    while len(latencies) < min_iterations or time.perf_counter() < deadline:
+        start = perf_counter_ns()
+        func()
+        latencies.append(perf_counter_ns() - start)
+    latencies.sort()
+    n = len(latencies)
+    total = sum(latencies)
+
+    def percentile(p):
+        return latencies[min(n - 1, int(n * p))] / 1000
+
+    return {
+        "iterations": n,
+        "ops_per_sec": n / (total / 1e9),
+        "mean_us": total / n / 1000,
+        "p50_us": percentile(0.50),
+        "p95_us": percentile(0.95),
+        "p99_us": percentile(0.99),
+    }
+
+
+def calc_cases():
+    for owner, is_legal in CALC_OWNERS.items():
+        for engine, (volume, power, is_electric, fuel_type) in CALC_ENGINES.items():
+            for age_name, age in CALC_AGES.items():
+                args = (2_500_000, volume, age, power, is_electric, is_legal, False, fuel_type, EUR_RATE)
+                yield f"calc/{owner}/{engine}/{age_name}", lambda args=args: calculate_customs_clearance(*args)
+
+
+def build_cases(catalog_url):
+    """Все сценарии: (название, функция)"""
+    cases = list(calc_cases())
+
+    def convert_cold():
+        # Без снимка в памяти курсы заново читаются из файла кэша
+        currency_converter._snapshot = None
+        currency_converter.convert_currency(1_000_000, "KRW", "RUB")
+
+    shared = SharedRates(os.path.join(os.path.dirname(currency_converter.CACHE_FILE), "rates.shm"))
+    shared.publish(currency_converter.get_rate_snapshot())
+
+    def convert_shared():
+        # Снимок из общего файла в памяти (SHARED_RATES_FILE) вместо проверки mtime файла кэша
+        shared.snapshot().convert(1_000_000, "KRW", "RUB")
+
+    cases += [
+        ("convert/warm", lambda: currency_converter.convert_currency(1_000_000, "KRW", "RUB")),
+        ("convert/cold", convert_cold),
+        ("convert/shared", convert_shared),
+        ("get_car_age", lambda: get_car_age("202203")),
+        ("get_car_id/id", lambda: get_car_id("38912345")),
+        ("get_car_id/link", lambda: get_car_id("https://fem.encar.com/cars/detail/38912345?carid=38912345")),
+    ]
+
+    client = CatalogClient(catalog_url)
+    car_ids = list(load_fixture("encar_catalog.json"))
+
+    def encar_pipeline():
+        # Полный путь: ссылка -> каталог -> разбор -> расчет (без кэша расчетов)
+        quote_cache.clear()
+        for car_id in car_ids:
+            car_id = get_car_id(f"https://fem.encar.com/cars/detail/{car_id}")["car_id"]
+            quote_listing(parse_listing(client.get_car(car_id)))
+
+    cases.append(("encar/pipeline", encar_pipeline))
+    return cases, client
+
+
+def compare(results, baseline, threshold):
+    """Возвращает список сценариев, где ops/sec упали больше чем на threshold"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        change = result["ops_per_sec"] / base["ops_per_sec"] - 1
+        result["change"] = change
+        if change < -threshold:
+            regressions.append((name, change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки калькулятора, конвертера и разбора Encar")
+    parser.add_argument("--filter", default="", help="Запускать только сценарии, содержащие подстроку")
+    parser.add_argument("--min-time", type=float, default=MIN_TIME, help="Секунд на сценарий")
+    parser.add_argument("--save", help="Сохранить результаты в JSON (базовые результаты)")
+    parser.add_argument("--compare", help="Сравнить с базовыми результатами из JSON")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="Допустимое падение ops/sec, доля (по умолчанию 0.15)")
+    args = parser.parse_args(argv)
+
+    workdir = tempfile.mkdtemp(prefix="customscalc-bench-")
+    # Курсы из записанного ответа ЦБ, без обращения к сети
+    currency_converter.CACHE_FILE = os.path.join(workdir, "currency_cache.json")
+    currency_converter.save_to_cache(load_fixture("cbr_daily.json")["Valute"])
+
+    results = {}
+    with catalog_server() as catalog:
+        cases, client = build_cases(catalog.url)
+        print(f"{'сценарий':<36}{'ops/sec':>14}{'p50, мкс':>12}{'p95, мкс':>12}{'p99, мкс':>12}")
+        for name, func in cases:
+            if args.filter not in name:
+                continue
+            result = results[name] = measure(func, args.min_time)
+            print(f"{name:<36}{result['ops_per_sec']:>14,.0f}{result['p50_us']:>12.1f}"
+                  f"{result['p95_us']:>12.1f}{result['p99_us']:>12.1f}")
+        client.close()
+
+    status = 0
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for name, change in regressions:
+            print(f"РЕГРЕССИЯ {name}: {change:+.1%}", file=sys.stderr)
+        if regressions:
+            status = 1
+        else:
+            print(f"Регрессий нет (порог {args.threshold:.0%})")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "results": results,
+            }, f, ensure_ascii=False, indent=2)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,123 @@
+import math
+
+from bulk_quote import car_params
+from currency_converter import get_rate_snapshot
+from sensitivity import PRICE, sweep_total
+from tariffs import get_schedule
+
+# Варианты расчета: (юридическое лицо, для перепродажи)
+VARIANTS = {
+    "personal": (False, False),
+    "resale": (False, True),
+    "legal": (True, False),
+}
+# Сколько раз уточнять ответ точным расчетом (погрешность округления на границах скобок)
+MAX_REFINE_STEPS = 64
+
+
+def _refine(sweep, segment, x, budget):
+    """Сдвигает x влево, пока точный расчет не уложится в бюджет"""
+    for _ in range(MAX_REFINE_STEPS):
+        if x <= segment.start:
+            return None
+        value = sweep.evaluate(x)
+        if value <= budget:
+            return x
+        if segment.slope > 0 and math.isclose(value, segment.value(x), rel_tol=1e-9):
+            # Точка на прямой участка: отступаем на величину превышения
+            x = math.nextafter(x - (value - budget) / segment.slope, -math.inf)
+        else:
+            # Граница скобки после округления попала в следующую скобку
+            x = math.nextafter(x, -math.inf)
+    return None
+
+
+def max_price(budget, currency='RUB', engine_volume=2000, car_age=4, engine_power=170, is_electric=False,
+              is_legal_entity=False, is_commercial=False, fuel_type=1, snapshot=None, schedule=None):
+    """
+    Максимальная цена авто, при которой цена + растаможка укладываются в бюджет.
+
+    Итог кусочно-линеен по цене (см. sensitivity.sweep_total), но не монотонен:
+    на границах скобок он может скачком уменьшаться (например, на 8 500 евро
+    у физлиц младше 3 лет ставка пошлины падает с 54% до 48%). Поэтому участки
+    перебираются справа налево, и на первом участке, где бюджет достижим,
+    ответ находится из уравнения прямой.
+
+    :param budget: Бюджет в рублях (цена авто + растаможка)
+    :param currency: Валюта цены (результат - в этой валюте)
+    :return: Цена в валюте currency или None, если бюджета не хватает даже при нулевой цене
+    """
+    snapshot = snapshot or get_rate_snapshot()
+    schedule = schedule or get_schedule()
+    # Итог не меньше цены в рублях, поэтому цена не больше бюджета
+    upper = budget / snapshot.convert(1, currency, 'RUB')
+    if upper <= 0:
+        return None
+    sweep = sweep_total(PRICE, 0, upper, upper, currency, engine_volume, car_age, engine_power, is_electric,
+                        is_legal_entity, is_commercial, fuel_type, snapshot, schedule)
+    for segment in reversed(sweep.segments):
+        if segment.slope > 0:
+            x = min(segment.end, (budget - segment.intercept) / segment.slope)
+        elif segment.value(segment.end) <= budget:
+            x = segment.end
+        else:
+            continue
+        if x > segment.start:
+            x = _refine(sweep, segment, x, budget)
+            if x is not None:
+                return x
+    if sweep.evaluate(0) <= budget:
+        return 0.0
+    return None
+
+
+def max_price_variants(budget, currency='RUB', engine_volume=2000, car_age=4, engine_power=170, is_electric=False,
+                       fuel_type=1, snapshot=None, schedule=None):
+    """Максимальная цена для каждого варианта из VARIANTS: {"personal": ..., "resale": ..., "legal": ...}"""
+    snapshot = snapshot or get_rate_snapshot()
+    schedule = schedule or get_schedule()
+    return {
+        name: max_price(budget, currency, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                        is_commercial, fuel_type, snapshot, schedule)
+        for name, (is_legal_entity, is_commercial) in VARIANTS.items()
+    }
+
+
+def score_rows(budget, rows, snapshot=None, schedule=None):
+    """
+    Проверяет список авто (например, лоты аукциона) на соответствие бюджету.
+
+    Строки - словари в формате bulk_quote.quote_row; поле price (текущая
+    ставка) необязательно. Для одинаковых авто решение считается один раз.
+
+    :return: Список словарей: max_price (в валюте строки), currency, fits
+        (укладывается ли текущая ставка), headroom (запас до максимальной
+        цены), error
+    """
+    snapshot = snapshot or get_rate_snapshot()
+    schedule = schedule or get_schedule()
+    solved = {}
+    results = []
+    for row in rows:
+        currency = row.get("currency") or "RUB"
+        if not isinstance(currency, str):
+            results.append({"error": "currency должна быть кодом валюты (строкой)"})
+            continue
+        try:
+            currency = currency.strip().upper()
+            params = (currency, *car_params(row))
+            if params not in solved:
+                solved[params] = max_price(budget, *params, snapshot=snapshot, schedule=schedule)
+            limit = solved[params]
+            price = row.get("price")
+            price = None if price in (None, "") else float(price)
+        except KeyError as e:
+            results.append({"error": f"валюта {e} не найдена"})
+            continue
+        except (TypeError, ValueError) as e:
+            results.append({"error": str(e)})
+            continue
+        fits = None if price is None else limit is not None and price <= limit
+        headroom = None if price is None or limit is None else limit - price
+        results.append({"max_price": limit, "currency": currency, "fits": fits, "headroom": headroom, "error": ""})
+    return results
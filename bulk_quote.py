@@ -0,0 +1,286 @@
+import argparse
+import csv
+import io
+import json
+import math
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from config import FEE_KEYS, calculate_customs_clearance, get_car_age
+from currency_converter import get_rate_snapshot, pin_rate_snapshot
+
+# Строк в одной единице работы для процесса
+CHUNK_SIZE = 2000
+# Сколько единиц работы на процесс может быть в очереди одновременно
+CHUNKS_PER_WORKER = 2
+# Как часто печатать прогресс (в секундах)
+PROGRESS_INTERVAL = 2.0
+
+# Названия столбцов результата
+OUTPUT_FIELDS = dict(zip(FEE_KEYS, (
+    "clearance_fee",
+    "customs_duty",
+    "recycling_fee",
+    "excise",
+    "vat",
+    "customs_total",
+)))
+RESULT_FIELDS = ["price_rub", *OUTPUT_FIELDS.values(), "total", "error"]
+# Поля входа, которые читает quote_row (столбцы CSV при пересчете JSONL в CSV)
+INPUT_FIELDS = ["price", "currency", "engine_volume", "engine_power", "car_age", "year_month", "fuel_type",
+                "is_electric", "is_legal_entity", "is_commercial"]
+# Числовые поля входа (разбираются _as_number)
+NUMBER_FIELDS = ("price", "engine_volume", "engine_power", "car_age", "fuel_type")
+
+_TRUE_VALUES = {"1", "true", "yes", "y", "да", "д"}
+
+
+def _as_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in _TRUE_VALUES
+
+
+def _as_number(value, default=None):
+    if value is None or value == "":
+        if default is None:
+            raise ValueError("значение не указано")
+        return default
+    try:
+        number = float(value)
+    except OverflowError:
+        # Целое из JSON, не помещающееся во float
+        number = math.inf
+    # nan, inf и 1e400 float() принимает, но расчет по ним бессмыслен и не выводится в JSON
+    if not math.isfinite(number):
+        raise ValueError(f"значение {value} должно быть конечным числом")
+    return int(number) if number.is_integer() else number
+
+
+def car_params(row):
+    """
+    Параметры авто из строки входного файла, кроме цены.
+
+    :return: (engine_volume, car_age, engine_power, is_electric, is_legal_entity, is_commercial, fuel_type)
+        в порядке аргументов calculate_customs_clearance
+    """
+    if row.get("car_age") not in (None, ""):
+        car_age = _as_number(row["car_age"])
+    else:
+        age = get_car_age(str(row.get("year_month") or ""))
+        if "error" in age:
+            raise ValueError(age["error"])
+        car_age = age["year"]
+    return (
+        _as_number(row.get("engine_volume")),
+        car_age,
+        _as_number(row.get("engine_power"), 170),
+        _as_bool(row.get("is_electric")),
+        _as_bool(row.get("is_legal_entity")),
+        _as_bool(row.get("is_commercial")),
+        int(_as_number(row.get("fuel_type"), 1)),
+    )
+
+
+def quote_row(row, snapshot, calculate=calculate_customs_clearance):
+    """
+    Рассчитывает растаможку для одной строки входного файла.
+
+    Ожидаемые поля: price, currency (по умолчанию RUB), engine_volume,
+    engine_power (по умолчанию 170), car_age или year_month (YYYYMM),
+    fuel_type (1 - Бензин, 2 - Дизель, 3 - Гибрид), is_electric,
+    is_legal_entity, is_commercial.
+
+    :param calculate: Функция расчета (например, с кэшированием результатов)
+    :return: Словарь результата (поля RESULT_FIELDS); при ошибке заполнено только поле error
+    """
+    currency = row.get("currency") or "RUB"
+    if not isinstance(currency, str):
+        return {"error": "currency должна быть кодом валюты (строкой)"}
+    try:
+        currency = currency.strip().upper()
+        price_rub = snapshot.convert(_as_number(row.get("price")), currency, "RUB")
+        fees = calculate(price_rub, *car_params(row), snapshot.to_rub("EUR"))
+        if not math.isfinite(price_rub + fees["Итоговая стоимость растаможки"]):
+            raise ValueError("сумма вне допустимого диапазона")
+    except KeyError as e:
+        return {"error": f"валюта {e} не найдена"}
+    except (TypeError, ValueError) as e:
+        return {"error": str(e)}
+
+    result = {"price_rub": round(price_rub, 2)}
+    for key, field in OUTPUT_FIELDS.items():
+        result[field] = round(fees[key], 2)
+    result["total"] = round(price_rub + fees["Итоговая стоимость растаможки"], 2)
+    result["error"] = ""
+    return result
+
+
+def _init_worker(snapshot):
+    # Все процессы считают по одному снимку курсов, без чтения кэша
+    pin_rate_snapshot(snapshot)
+
+
+def _format_chunk(records, in_format, header, out_format, snapshot):
+    """
+    Разбирает порцию записей, считает ее и возвращает готовый текст результата.
+
+    Записи - списки значений CSV или строки JSONL. header - столбцы входа
+    CSV, а для JSONL с выводом в CSV - INPUT_FIELDS.
+    Разбор и форматирование выполняются в дочернем процессе, главному
+    остается только читать и писать текст.
+    """
+    out = io.StringIO()
+    writer = csv.writer(out) if out_format == "csv" else None
+    for record in records:
+        if in_format == "csv":
+            row = dict(zip(header, record))
+            result = quote_row(row, snapshot)
+        else:
+            try:
+                row = json.loads(record)
+            except ValueError as e:
+                row = None
+                result = {"error": f"некорректный JSON: {e}"}
+            else:
+                if isinstance(row, dict):
+                    result = quote_row(row, snapshot)
+                else:
+                    result = {"error": "ожидается JSON-объект"}
+            if not isinstance(row, dict):
+                row = {}
+        if writer is not None:
+            writer.writerow([row.get(field, "") for field in header]
+                            + [result.get(field, "") for field in RESULT_FIELDS])
+        else:
+            row.update((field, result.get(field, "")) for field in RESULT_FIELDS)
+            out.write(json.dumps(row, ensure_ascii=False) + "\n")
+    return out.getvalue()
+
+
+def _quote_chunk(records, in_format, header, out_format):
+    return _format_chunk(records, in_format, header, out_format, get_rate_snapshot())
+
+
+def _chunks(records, size):
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if path.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+
+def _read_records(f, in_format):
+    """Записи входного файла: списки значений CSV (без заголовка) или непустые строки JSONL"""
+    if in_format == "csv":
+        return csv.reader(f)
+    return (line for line in f if line.strip())
+
+
+def quote_file(fin, fout, in_format, out_format, snapshot, workers=None, chunk_size=CHUNK_SIZE, progress=None):
+    """
+    Потоково рассчитывает файл и пишет результат в исходном порядке строк.
+
+    Записи читаются порциями по chunk_size; в работе одновременно не больше
+    workers * CHUNKS_PER_WORKER порций, поэтому память не зависит от размера
+    файла. workers=0 - расчет в текущем процессе.
+
+    :param progress: Функция, которую вызывают с числом обработанных строк после каждой порции
+    :return: Количество обработанных строк
+    """
+    records = _read_records(fin, in_format)
+    header = next(records, []) if in_format == "csv" else None
+    if out_format == "csv":
+        if in_format != "csv":
+            # У строк JSONL может не быть общего набора полей: выводятся поля, которые читает расчет
+            header = INPUT_FIELDS
+        csv.writer(fout).writerow(header + RESULT_FIELDS)
+
+    count = 0
+
+    def done(chunk, text):
+        nonlocal count
+        fout.write(text)
+        count += len(chunk)
+        if progress is not None:
+            progress(count)
+
+    if workers == 0:
+        for chunk in _chunks(records, chunk_size):
+            done(chunk, _format_chunk(chunk, in_format, header, out_format, snapshot))
+        return count
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(snapshot,)) as pool:
+        pending = deque()
+        for chunk in _chunks(records, chunk_size):
+            pending.append((chunk, pool.submit(_quote_chunk, chunk, in_format, header, out_format)))
+            if len(pending) >= workers * CHUNKS_PER_WORKER:
+                chunk, future = pending.popleft()
+                done(chunk, future.result())
+        while pending:
+            chunk, future = pending.popleft()
+            done(chunk, future.result())
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный расчет растаможки для файла CSV/JSONL")
+    parser.add_argument("input", help="Входной файл (CSV с заголовком или JSONL), '-' - stdin")
+    parser.add_argument("output", help="Файл результата, '-' - stdout")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Формат входа (по умолчанию по расширению)")
+    parser.add_argument("--output-format", choices=["csv", "jsonl"], help="Формат результата (по умолчанию как вход)")
+    parser.add_argument("--workers", type=int, default=None, help="Число процессов (0 - без пула)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="Строк в единице работы")
+    args = parser.parse_args(argv)
+
+    # Курсы определяются один раз на весь файл
+    snapshot = get_rate_snapshot()
+    if snapshot is None:
+        print("Не удалось получить курсы валют", file=sys.stderr)
+        return 1
+    pin_rate_snapshot(snapshot)
+    print(f"Курсы ЦБ: {snapshot.version}, 1 EUR = {snapshot.to_rub('EUR')} ₽", file=sys.stderr)
+
+    in_format = _detect_format(args.input, args.format)
+    out_format = args.output_format or (_detect_format(args.output, None) if args.output != "-" else in_format)
+    fin = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8", newline="")
+    fout = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+
+    started = time.perf_counter()
+    last_report = started
+
+    def progress(count):
+        nonlocal last_report
+        now = time.perf_counter()
+        if now - last_report >= PROGRESS_INTERVAL:
+            last_report = now
+            print(f"Обработано строк: {count} ({count / (now - started):,.0f} строк/с)", file=sys.stderr)
+
+    try:
+        count = quote_file(fin, fout, in_format, out_format, snapshot, args.workers, args.chunk_size, progress)
+    finally:
+        if fin is not sys.stdin:
+            fin.close()
+        if fout is not sys.stdout:
+            fout.close()
+
+    elapsed = time.perf_counter() - started
+    rate = count / elapsed if elapsed else 0
+    print(f"Готово: {count} строк, {elapsed:.1f} с, {rate:,.0f} строк/с", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,140 +1,503 @@
-import requests
-from datetime import datetime, timedelta
-import json
-import os
-
-# Настройки кэширования
-CACHE_FILE = "currency_cache.json"
-CACHE_DURATION = timedelta(hours=6)
-
-
-def get_cached_rates():
-    """Проверяет наличие актуального кэша"""
-    if not os.path.exists(CACHE_FILE):
-        return None
-
-    try:
-        with open(CACHE_FILE, "r", encoding="utf-8") as f:
-            cache = json.load(f)
-
-        cache_time = datetime.fromisoformat(cache["timestamp"])
-        if datetime.now() - cache_time < CACHE_DURATION:
-            return cache["data"]
-    except Exception as e:
-        print(f"Ошибка чтения кэша: {e}")
-
-    return None
-
-
-def save_to_cache(data):
-    """Сохраняет данные в кэш"""
-    try:
-        cache = {
-            "timestamp": datetime.now().isoformat(),
-            "data": data
-        }
-        with open(CACHE_FILE, "w", encoding="utf-8") as f:
-            json.dump(cache, f, ensure_ascii=False, indent=2)
-    except Exception as e:
-        print(f"Ошибка сохранения кэша: {e}")
-
-
-def get_currency_rates():
-    """Получает курсы валют с использованием кэширования"""
-    # Сначала проверяем кэш
-    cached_data = get_cached_rates()
-    if cached_data is not None:
-        return cached_data
-
-    # Если нет актуального кэша, загружаем новые данные
-    try:
-        url = "https://www.cbr-xml-daily.ru/daily_json.js"
-        response = requests.get(url, timeout=10)
-        response.raise_for_status()
-        data = response.json()
-        valutes = data["Valute"]
-
-        # Сохраняем в кэш
-        save_to_cache(valutes)
-        return valutes
-    except requests.exceptions.RequestException as e:
-        print(f"Ошибка при получении курсов валют: {e}")
-        return None
-
-
-def convert_currency(amount, from_currency, to_currency):
-    """Конвертирует сумму из одной валюты в другую"""
-    rates = get_currency_rates()
-
-    if rates is None:
-        print("Не удалось получить курсы валют. Попробуйте позже.")
-        return None
-
-    from_currency = from_currency.upper()
-    to_currency = to_currency.upper()
-
-    # Конвертация через рубли
-    try:
-        # 1. Конвертируем исходную валюту в рубли
-        if from_currency == "RUB":
-            rub_amount = amount
-        else:
-            from_rate = rates[from_currency]["Value"]
-            from_nominal = rates[from_currency]["Nominal"]
-            rub_amount = amount * (from_rate / from_nominal)
-
-        # 2. Конвертируем рубли в целевую валюту
-        if to_currency == "RUB":
-            return rub_amount
-        else:
-            to_rate = rates[to_currency]["Value"]
-            to_nominal = rates[to_currency]["Nominal"]
-            return rub_amount / (to_rate / to_nominal)
-
-    except KeyError as e:
-        print(f"Ошибка: валюта {e} не найдена в списке доступных")
-        return None
-
-
-def print_available_currencies(rates):
-    """Печатает список доступных валют"""
-    print("\nДоступные валюты:")
-    for code, currency in rates.items():
-        print(f"{code}: {currency['Name']} ({currency['Nominal']} {code} = {currency['Value']} RUB)")
-
-
-def main():
-    print("Конвертер валют по курсу ЦБ РФ с кэшированием")
-
-    # Предварительная загрузка курсов
-    rates = get_currency_rates()
-    if rates is None:
-        print("Не удалось загрузить курсы валют. Проверьте подключение к интернету.")
-        return
-
-    print_available_currencies(rates)
-
-    while True:
-        try:
-            print("\nВведите данные для конвертации:")
-            amount = float(input("Сумма: "))
-            from_curr = input("Из валюты (код из 3 букв, например USD): ").strip().upper()
-            to_curr = input("В валюту (код из 3 букв, например EUR): ").strip().upper()
-
-            result = convert_currency(amount, from_curr, to_curr)
-
-            if result is not None:
-                print(f"\nРезультат: {amount:.2f} {from_curr} = {result:.2f} {to_curr}")
-
-            if input("\nПродолжить? (y/n): ").lower() != 'y':
-                break
-
-        except ValueError:
-            print("Ошибка: введите корректную сумму")
-        except KeyboardInterrupt:
-            print("\nВыход из программы")
-            break
-
-
-if __name__ == "__main__":
+from datetime import datetime, timedelta
+import json
+import os
+import tempfile
+import threading
+from types import MappingProxyType
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка файла недоступна, запись остается атомарной
+    fcntl = None
+
+# Настройки кэширования
+CACHE_FILE = "currency_cache.json"
+CACHE_DURATION = timedelta(hours=6)
+# Фоновое обновление начинается за это время до истечения кэша
+REFRESH_AHEAD = timedelta(minutes=30)
+# Как часто фоновый поток проверяет возраст курсов (в секундах)
+REFRESH_CHECK_INTERVAL = 60
+# Пауза перед повторной попыткой после неудачной загрузки
+RETRY_AFTER = timedelta(minutes=1)
+
+# Адрес можно подменить (например, на standins.cbr_server в нагрузочном тесте)
+CBR_URL = os.environ.get("CBR_URL", "https://www.cbr-xml-daily.ru/daily_json.js")
+# Файл общего для всех процессов машины снимка курсов (shared_rates); не задан - у каждого процесса свой снимок
+SHARED_RATES_FILE = os.environ.get("SHARED_RATES_FILE")
+# Снимок курсов, собранный при сборке (python startup.py bundle). Отдается, пока нет своего кэша,
+# чтобы первый запуск не ждал ответа ЦБ; свежие курсы загружаются в фоне
+BUNDLED_RATES_FILE = os.environ.get("BUNDLED_RATES_FILE",
+                                    os.path.join(os.path.dirname(os.path.abspath(__file__)), "rates_snapshot.json"))
+
+
+class RateSnapshot:
+    """
+    Неизменяемый снимок курсов ЦБ в памяти процесса.
+
+    Хранит заранее посчитанную рублевую стоимость одной единицы каждой валюты
+    (Value / Nominal), поэтому конвертация сводится к поиску в словаре и одному
+    умножению (делению) без чтения файла кэша.
+
+    Для массовой конвертации у каждой валюты есть номер (code_index), а
+    матрица кросс-курсов cross_rates строится один раз при первом обращении.
+    """
+    __slots__ = ('factors', 'rates', 'version', 'timestamp', 'source_mtime', 'codes', 'code_index', '_cross_rates')
+
+    def __init__(self, rates, timestamp, source_mtime=None):
+        factors = {"RUB": 1.0}
+        for code, currency in rates.items():
+            factors[code] = currency["Value"] / currency["Nominal"]
+        object.__setattr__(self, 'factors', MappingProxyType(factors))
+        object.__setattr__(self, 'codes', tuple(factors))
+        object.__setattr__(self, 'code_index', MappingProxyType({code: i for i, code in enumerate(factors)}))
+        object.__setattr__(self, '_cross_rates', None)
+        object.__setattr__(self, 'rates', MappingProxyType(dict(rates)))
+        # Версия курсов - время их загрузки с сайта ЦБ
+        object.__setattr__(self, 'version', timestamp.isoformat())
+        object.__setattr__(self, 'timestamp', timestamp)
+        object.__setattr__(self, 'source_mtime', source_mtime)
+
+    @classmethod
+    def from_factors(cls, factors, timestamp, source_mtime=None):
+        """Снимок из готовых рублевых стоимостей единицы валюты (без исходного ответа ЦБ)"""
+        rates = {code: {"Value": factor, "Nominal": 1} for code, factor in factors.items() if code != "RUB"}
+        return cls(rates, timestamp, source_mtime)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RateSnapshot неизменяем")
+
+    def __reduce__(self):
+        # Снимок передается в дочерние процессы пакетного расчета
+        return RateSnapshot, (dict(self.rates), self.timestamp, self.source_mtime)
+
+    def __repr__(self):
+        return f"RateSnapshot(version={self.version!r}, currencies={len(self.factors)})"
+
+    def is_fresh(self, now=None):
+        """Проверяет, не истек ли срок жизни курсов"""
+        return (now or datetime.now()) - self.timestamp < CACHE_DURATION
+
+    def needs_refresh(self, now=None):
+        """Пора ли заранее обновить курсы (за REFRESH_AHEAD до истечения)"""
+        return (now or datetime.now()) - self.timestamp >= CACHE_DURATION - REFRESH_AHEAD
+
+    def to_rub(self, currency):
+        """Рублевая стоимость одной единицы валюты (KeyError для неизвестной валюты)"""
+        return self.factors[currency]
+
+    def convert(self, amount, from_currency, to_currency):
+        """Конвертирует сумму через рубли. Коды валют должны быть в верхнем регистре"""
+        factors = self.factors
+        rub_amount = amount if from_currency == "RUB" else amount * factors[from_currency]
+        if to_currency == "RUB":
+            return rub_amount
+        return rub_amount / factors[to_currency]
+
+    @property
+    def cross_rates(self):
+        """
+        Матрица N×N кросс-курсов (numpy): cross_rates[i, j] - сколько единиц
+        валюты codes[j] стоит одна единица валюты codes[i].
+        """
+        matrix = self._cross_rates
+        if matrix is None:
+            import numpy as np  # numpy нужен только для массовой конвертации
+            factors = np.fromiter(self.factors.values(), dtype=float, count=len(self.factors))
+            matrix = factors[:, None] / factors[None, :]
+            matrix.flags.writeable = False
+            object.__setattr__(self, '_cross_rates', matrix)
+        return matrix
+
+    def convert_indexed(self, amounts, from_index, to_index):
+        """
+        Векторная конвертация по номерам валют из code_index.
+
+        amounts, from_index и to_index - числа или массивы одной формы (или
+        растягиваемые друг на друга); вся конвертация - одно умножение на
+        элементы матрицы cross_rates.
+        """
+        return amounts * self.cross_rates[from_index, to_index]
+
+
+# Активный снимок курсов процесса
+_snapshot = None
+# Зафиксированный снимок (пакетные расчеты), имеет приоритет над кэшем
+_pinned = None
+
+# Одновременно в процессе выполняется не более одной загрузки курсов
+_fetch_lock = threading.Lock()
+_fetch_generation = 0
+_last_fetch = None
+_last_failure = None
+_background_lock = threading.Lock()
+_background_thread = None
+_refresher_thread = None
+_refresher_stop = threading.Event()
+# Общий снимок курсов (SharedRates); False - не используется
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def _shared_rates():
+    """Общий снимок курсов машины или None, если SHARED_RATES_FILE не задан или не открывается"""
+    global _shared
+    if _shared is None:
+        with _shared_lock:
+            if _shared is None:
+                _shared = False
+                if SHARED_RATES_FILE:
+                    from shared_rates import SharedRates
+                    try:
+                        _shared = SharedRates(SHARED_RATES_FILE)
+                    except OSError as e:
+                        print(f"Ошибка открытия общего снимка курсов: {e}")
+    return _shared or None
+
+
+def _cache_mtime():
+    """Время изменения файла кэша или None, если файла нет"""
+    try:
+        return os.stat(CACHE_FILE).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _read_cache(path=None):
+    """Читает файл кэша (по умолчанию CACHE_FILE) целиком ({"timestamp", "data"}) или возвращает None"""
+    path = path or CACHE_FILE
+    if not os.path.exists(path):
+        return None
+
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        # Проверяем структуру, чтобы битый файл не попал в снимок
+        datetime.fromisoformat(cache["timestamp"])
+        if not isinstance(cache["data"], dict):
+            raise ValueError("поле data должно быть словарем")
+        return cache
+    except Exception as e:
+        print(f"Ошибка чтения кэша: {e}")
+
+    return None
+
+
+def _is_cache_fresh(cache):
+    return datetime.now() - datetime.fromisoformat(cache["timestamp"]) < CACHE_DURATION
+
+
+def get_cached_rates():
+    """Проверяет наличие актуального кэша"""
+    cache = _read_cache()
+    if cache is not None and _is_cache_fresh(cache):
+        return cache["data"]
+
+    return None
+
+
+def save_to_cache(data):
+    """
+    Сохраняет данные в кэш и возвращает записанную структуру.
+
+    Файл пишется атомарно (временный файл + переименование) под
+    рекомендательной блокировкой, поэтому читатели никогда не видят
+    наполовину записанный JSON.
+    """
+    cache = {
+        "timestamp": datetime.now().isoformat(),
+        "data": data
+    }
+    try:
+        cache_dir = os.path.dirname(os.path.abspath(CACHE_FILE))
+        with open(CACHE_FILE + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            fd, tmp_path = tempfile.mkstemp(prefix=".currency_cache.", suffix=".tmp", dir=cache_dir)
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    json.dump(cache, f, ensure_ascii=False, indent=2)
+                os.replace(tmp_path, CACHE_FILE)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+    except Exception as e:
+        print(f"Ошибка сохранения кэша: {e}")
+    return cache
+
+
+@metrics.timed("cbr_fetch")
+def _fetch_rates():
+    """Загружает курсы с сайта ЦБ и сохраняет их в кэш"""
+    import requests  # requests нужен только для загрузки: без него запуск быстрее
+    try:
+        response = requests.get(CBR_URL, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        valutes = data["Valute"]
+
+        # Сохраняем в кэш
+        return save_to_cache(valutes)
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        metrics.upstream_error("cbr")
+        print(f"Ошибка при получении курсов валют: {e}")
+        return None
+
+
+def _refresh_rates():
+    """
+    Загружает курсы, объединяя одновременные запросы.
+
+    Если загрузка уже идет в другом потоке, вызывающий дожидается ее и
+    получает тот же результат вместо повторного запроса к ЦБ.
+    """
+    global _fetch_generation, _last_fetch, _last_failure
+    generation = _fetch_generation
+    with _fetch_lock:
+        if _fetch_generation != generation:
+            return _last_fetch
+        # Пока ждали, кэш мог обновить другой процесс
+        cache = _read_cache()
+        if cache is None or _needs_refresh(cache):
+            cache = _fetch_rates()
+            _last_failure = datetime.now() if cache is None else None
+        _last_fetch = cache
+        _fetch_generation += 1
+        return cache
+
+
+def _needs_refresh(cache):
+    age = datetime.now() - datetime.fromisoformat(cache["timestamp"])
+    return age >= CACHE_DURATION - REFRESH_AHEAD
+
+
+def _install_snapshot(cache):
+    """Делает снимок из структуры кэша активным"""
+    global _snapshot
+    snapshot = RateSnapshot(cache["data"], datetime.fromisoformat(cache["timestamp"]), _cache_mtime())
+    _snapshot = snapshot
+    shared = _shared_rates()
+    if shared is not None:
+        # Остальные процессы машины получат новые курсы без чтения файла кэша
+        try:
+            shared.publish(snapshot)
+        except (OSError, ValueError) as e:
+            print(f"Ошибка публикации общего снимка курсов: {e}")
+    return snapshot
+
+
+def _refresh_snapshot():
+    cache = _refresh_rates()
+    if cache is not None:
+        return _install_snapshot(cache)
+    return None
+
+
+def refresh_in_background():
+    """Запускает фоновое обновление курсов, если оно еще не идет"""
+    global _background_thread
+    with _background_lock:
+        if _background_thread is not None and _background_thread.is_alive():
+            return _background_thread
+        if _last_failure is not None and datetime.now() - _last_failure < RETRY_AFTER:
+            return None
+        _background_thread = threading.Thread(target=_refresh_snapshot, name="rates-refresh", daemon=True)
+        _background_thread.start()
+        return _background_thread
+
+
+def _refresher_loop(check_interval):
+    while not _refresher_stop.wait(check_interval):
+        shared = _shared_rates()
+        snapshot = (shared.snapshot() if shared is not None else None) or _snapshot
+        if snapshot is None or snapshot.needs_refresh():
+            try:
+                _refresh_snapshot()
+            except Exception as e:
+                print(f"Ошибка фонового обновления курсов: {e}")
+
+
+def start_rate_refresher(check_interval=REFRESH_CHECK_INTERVAL):
+    """
+    Запускает поток, который обновляет курсы до истечения кэша.
+
+    Повторный вызов возвращает уже запущенный поток.
+    """
+    global _refresher_thread
+    with _background_lock:
+        if _refresher_thread is not None and _refresher_thread.is_alive():
+            return _refresher_thread
+        _refresher_stop.clear()
+        _refresher_thread = threading.Thread(target=_refresher_loop, args=(check_interval,),
+                                             name="rates-refresher", daemon=True)
+        _refresher_thread.start()
+        return _refresher_thread
+
+
+def stop_rate_refresher():
+    """Останавливает фоновый поток обновления курсов"""
+    _refresher_stop.set()
+
+
+def get_currency_rates():
+    """Получает курсы валют с использованием кэширования"""
+    # Сначала проверяем кэш
+    cached_data = get_cached_rates()
+    if cached_data is not None:
+        return cached_data
+
+    # Если нет актуального кэша, загружаем новые данные
+    cache = _refresh_rates()
+    return cache["data"] if cache is not None else None
+
+
+def get_rate_snapshot():
+    """
+    Возвращает актуальный снимок курсов.
+
+    Файл кэша перечитывается только если он изменился (mtime) или истек срок
+    жизни курсов (CACHE_DURATION), иначе отдается снимок из памяти.
+    Устаревший снимок продолжает отдаваться, пока курсы обновляются в фоне;
+    ждать загрузки приходится только при первом запуске без кэша.
+
+    Если задан SHARED_RATES_FILE, снимок берется из общего для процессов
+    файла в памяти (shared_rates): проверка новой версии - чтение одного
+    числа, файл кэша читается только до первой публикации.
+    """
+    if _pinned is not None:
+        return _pinned
+    shared = _shared_rates()
+    if shared is not None:
+        snapshot = shared.snapshot()
+        if snapshot is not None:
+            metrics.cache_hit("rates", True)
+            if not snapshot.is_fresh():
+                refresh_in_background()
+            return snapshot
+    snapshot = _snapshot
+    mtime = _cache_mtime()
+    if snapshot is not None and snapshot.source_mtime == mtime:
+        metrics.cache_hit("rates", True)
+        if snapshot.is_fresh():
+            return snapshot
+        refresh_in_background()
+        return snapshot
+
+    metrics.cache_hit("rates", False)
+    with metrics.timed("rates_load"):
+        return _load_snapshot(snapshot)
+
+
+def _load_snapshot(snapshot):
+    cache = _read_cache()
+    if cache is not None:
+        snapshot = _install_snapshot(cache)
+        if not snapshot.is_fresh():
+            refresh_in_background()
+        return snapshot
+
+    if snapshot is not None:
+        refresh_in_background()
+        return snapshot
+
+    # Первый запуск без кэша: отдаем собранный снимок, пока курсы загружаются в фоне
+    bundle = _read_cache(BUNDLED_RATES_FILE)
+    if bundle is not None:
+        snapshot = _install_snapshot(bundle)
+        if not snapshot.is_fresh():
+            refresh_in_background()
+        return snapshot
+    return _refresh_snapshot()
+
+
+def pin_rate_snapshot(snapshot):
+    """
+    Фиксирует снимок курсов для всего процесса.
+
+    Пока снимок зафиксирован, get_rate_snapshot возвращает его без проверки
+    кэша и фонового обновления, поэтому весь пакет считается по одним курсам.
+    None снимает фиксацию.
+    """
+    global _pinned
+    _pinned = snapshot
+
+
+def get_snapshot_on(on_date=None):
+    """Снимок курсов на дату из локальной истории (rate_history) или текущий, если дата не указана"""
+    if on_date is None:
+        return get_rate_snapshot()
+    from rate_history import get_snapshot_on
+    return get_snapshot_on(on_date)
+
+
+def convert_currency(amount, from_currency, to_currency, on_date=None):
+    """
+    Конвертирует сумму из одной валюты в другую.
+
+    :param on_date: Дата, на которую берется курс ЦБ (из локальной истории
+        курсов, без запросов в сеть). По умолчанию - текущий курс
+    """
+    snapshot = get_snapshot_on(on_date)
+
+    if snapshot is None:
+        if on_date is not None:
+            print(f"Нет курсов валют на {on_date}. Загрузите историю: python rate_history.py backfill ...")
+            return None
+        print("Не удалось получить курсы валют. Попробуйте позже.")
+        return None
+
+    # Конвертация через рубли; коды обычно уже в верхнем регистре
+    try:
+        return snapshot.convert(amount, from_currency, to_currency)
+    except KeyError:
+        pass
+    try:
+        return snapshot.convert(amount, from_currency.upper(), to_currency.upper())
+    except KeyError as e:
+        print(f"Ошибка: валюта {e} не найдена в списке доступных")
+        return None
+
+
+def print_available_currencies(rates):
+    """Печатает список доступных валют"""
+    print("\nДоступные валюты:")
+    for code, currency in rates.items():
+        print(f"{code}: {currency['Name']} ({currency['Nominal']} {code} = {currency['Value']} RUB)")
+
+
+def main():
+    print("Конвертер валют по курсу ЦБ РФ с кэшированием")
+
+    # Предварительная загрузка курсов
+    rates = get_currency_rates()
+    if rates is None:
+        print("Не удалось загрузить курсы валют. Проверьте подключение к интернету.")
+        return
+
+    print_available_currencies(rates)
+
+    while True:
+        try:
+            print("\nВведите данные для конвертации:")
+            amount = float(input("Сумма: "))
+            from_curr = input("Из валюты (код из 3 букв, например USD): ").strip().upper()
+            to_curr = input("В валюту (код из 3 букв, например EUR): ").strip().upper()
+
+            result = convert_currency(amount, from_curr, to_curr)
+
+            if result is not None:
+                print(f"\nРезультат: {amount:.2f} {from_curr} = {result:.2f} {to_curr}")
+
+            if input("\nПродолжить? (y/n): ").lower() != 'y':
+                break
+
+        except ValueError:
+            print("Ошибка: введите корректную сумму")
+        except KeyboardInterrupt:
+            print("\nВыход из программы")
+            break
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,147 @@
+import heapq
+import itertools
+import threading
+from dataclasses import dataclass
+from datetime import date
+
+# Авто "проходное", пока с месяца выпуска прошло от 36 до 60 месяцев (см. config.get_car_age)
+ELIGIBLE_FROM_MONTHS = 36
+ELIGIBLE_UNTIL_MONTHS = 60
+
+ENTER = "enter"
+LEAVE = "leave"
+
+
+def _parse_year_month(year_month):
+    year_month = str(year_month)
+    if len(year_month) < 6 or not year_month[:6].isdigit():
+        raise ValueError(f'Неверный формат даты {year_month!r}. Используйте "YYYYMM"')
+    year, month = int(year_month[:4]), int(year_month[4:6])
+    if not 1 <= month <= 12:
+        raise ValueError(f"Неверный месяц в {year_month!r} (должен быть 01-12)")
+    return year, month
+
+
+def _add_months(year, month, months):
+    year, month = divmod(year * 12 + month - 1 + months, 12)
+    return date(year, month + 1, 1)
+
+
+def transition_dates(year_month):
+    """
+    Даты, когда авто с датой выпуска year_month становится проходным и перестает им быть.
+
+    Возраст считается в полных месяцах от 1-го числа месяца выпуска, поэтому
+    статус меняется 1-го числа месяца.
+
+    :return: (дата входа в окно 36-60 месяцев, дата выхода из него)
+    """
+    year, month = _parse_year_month(year_month)
+    return (_add_months(year, month, ELIGIBLE_FROM_MONTHS),
+            _add_months(year, month, ELIGIBLE_UNTIL_MONTHS + 1))
+
+
+@dataclass(slots=True, frozen=True)
+class Transition:
+    """Смена статуса 'проходное' у отслеживаемого объявления"""
+    listing_id: str
+    year_month: str
+    event: str
+    on_date: date
+
+    @property
+    def is_eligible(self):
+        return self.event == ENTER
+
+
+class EligibilitySchedule:
+    """
+    Календарь смены статуса 'проходное' для отслеживаемых объявлений.
+
+    Объявления группируются по году и месяцу выпуска; для каждой группы в
+    куче лежат ближайшие даты входа в окно 36-60 месяцев и выхода из него.
+    Ежедневная задача вызывает pop_due() и получает только объявления, у
+    которых статус (а значит и расчет растаможки) изменился, без перебора
+    всех отслеживаемых авто.
+
+    Опустевшая группа удаляется, а ее записи в куче становятся
+    недействительными и выбрасываются, когда оказываются на вершине.
+    """
+
+    def __init__(self, today=None):
+        self.today = today or date.today()
+        self._heap = []
+        self._groups = {}
+        self._year_month_of = {}
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._year_month_of)
+
+    def add(self, listing_id, year_month, today=None):
+        """
+        Начинает отслеживать объявление (повторный вызов обновляет дату выпуска).
+
+        :param today: Текущая дата (по умолчанию сегодня): переходы не позже нее не планируются
+        """
+        year_month = str(year_month)[:6]
+        transitions = transition_dates(year_month)
+        today = today or date.today()
+        with self._lock:
+            # После долгого простоя self.today отстает: без обновления прошедшие даты попали бы в кучу
+            self.today = max(self.today, today)
+            self._discard(listing_id)
+            self._year_month_of[listing_id] = year_month
+            group = self._groups.get(year_month)
+            if group is None:
+                # Группа создается с первым объявлением месяца выпуска (групп не больше, чем месяцев),
+                # и ее даты попадают в кучу один раз; прошедшие переходы не планируются
+                group = self._groups[year_month] = set()
+                for on_date, event in zip(transitions, (ENTER, LEAVE)):
+                    if on_date > self.today:
+                        heapq.heappush(self._heap, (on_date, year_month, event, next(self._seq), group))
+            group.add(listing_id)
+
+    def remove(self, listing_id):
+        with self._lock:
+            self._discard(listing_id)
+
+    def _discard(self, listing_id):
+        year_month = self._year_month_of.pop(listing_id, None)
+        if year_month is None:
+            return
+        group = self._groups[year_month]
+        group.discard(listing_id)
+        if not group:
+            del self._groups[year_month]
+
+    def _drop_stale(self):
+        """Убирает с вершины кучи записи удаленных групп"""
+        heap = self._heap
+        while heap and self._groups.get(heap[0][1]) is not heap[0][4]:
+            heapq.heappop(heap)
+
+    def next_date(self):
+        """Ближайшая дата смены статуса или None"""
+        with self._lock:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def pop_due(self, today=None):
+        """
+        Забирает смены статуса, наступившие не позже today (по умолчанию сегодня).
+
+        :return: Список Transition в порядке дат
+        """
+        today = today or date.today()
+        due = []
+        with self._lock:
+            self._drop_stale()
+            while self._heap and self._heap[0][0] <= today:
+                on_date, year_month, event, _, group = heapq.heappop(self._heap)
+                for listing_id in group:
+                    due.append(Transition(listing_id, year_month, event, on_date))
+                self._drop_stale()
+            self.today = max(self.today, today)
+        return due
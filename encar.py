@@ -0,0 +1,215 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+from config import FEE_KEYS, get_car_age
+from currency_converter import get_rate_snapshot
+from encar_photos import get_photo_url, is_photo_path
+from quote_cache import cached_customs_clearance
+
+FUEL_TYPES = {
+    '001': 'Бензин',
+    '002': 'Дизель',
+    '003': 'Сжиженный газ',
+    '005': 'Бензин + сжиженный газ',
+    '006': 'Бензин + Электричество',
+    '007': 'Дизель + Электричество',
+    '009': 'Электричество',
+}
+ELECTRIC_FUEL_CODE = '009'
+DIESEL_FUEL_CODE = '002'
+# Сервис миниатюр (photo_cache.py, например http://127.0.0.1:8601/); не задан - браузер берет фото с Encar
+PHOTO_CACHE_URL = os.environ.get("PHOTO_CACHE_URL", "")
+# Мощность по умолчанию для ДВС (в карточке Encar мощности нет)
+DEFAULT_ENGINE_POWER = 170
+
+
+def get_car_id(url):
+    if len(url) == 8 and url.isdigit():
+        return {
+            'code': 'ok',
+            'car_id': url
+        }
+    if (8 < len(url) or len(url) < 8) and url.isdigit():
+        return {
+            'code': 'error',
+            'message': f'CAR_ID должен содержать 8 символов. Сейчас их - {len(url)}'
+        }
+    k = url.split('detail/')
+    if len(k) != 2:
+        return {
+            'code': 'error',
+            'message': 'Неверный формат ссылки (отсутствует "detail/")'
+        }
+    j = k[1]
+    j = j[0:8]
+    if len(j) == 8:
+        return {
+            'code': 'ok',
+            'car_id': j
+        }
+    return {
+        'code': 'error',
+        'message': f'Неизвестная ошибка. Отправьте разработчику:\n'
+                   f'{url}'
+    }
+
+
+def photo_url(photo_path):
+    """Ссылка на фото для браузера: миниатюра из сервиса фотографий, если задан PHOTO_CACHE_URL"""
+    if PHOTO_CACHE_URL and is_photo_path(photo_path):
+        return PHOTO_CACHE_URL.rstrip('/') + '/photo' + photo_path
+    return get_photo_url(photo_path)
+
+
+_prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="photo-prefetch")
+
+
+def prefetch_photo(photo_path):
+    """
+    Просит сервис фотографий загрузить фото, пока страница еще считается:
+    к запросу браузера миниатюра уже будет на диске. Без PHOTO_CACHE_URL
+    ничего не делает.
+    """
+    if PHOTO_CACHE_URL and is_photo_path(photo_path):
+        _prefetch_executor.submit(_warm_photo, photo_url(photo_path))
+
+
+def _warm_photo(url):
+    import requests
+    try:
+        requests.head(url, timeout=5).close()
+    except requests.exceptions.RequestException:
+        pass  # браузер запросит фото сам
+
+
+@dataclass(slots=True, frozen=True)
+class Listing:
+    """Поля карточки Encar, нужные для отображения и расчета"""
+    manufacturer: str
+    model: str
+    grade: str
+    year_month: str
+    price_krw: int
+    displacement: int
+    fuel_code: str
+    photo_path: str
+
+    def as_dict(self):
+        return asdict(self)
+
+
+def parse_listing(data):
+    """
+    Достает из карточки каталога поля, нужные для расчета.
+
+    :param data: Ответ каталога (catalog?car=...)
+    :return: Listing или None, если авто не найдено
+    """
+    if data.get('code') == 404:
+        return None
+    vehicle = data['vehicle']
+    category = vehicle['category']
+    return Listing(
+        manufacturer=category['manufacturerEnglishName'],
+        model=category['modelGroupEnglishName'],
+        grade=category['gradeEnglishName'],
+        year_month=category['yearMonth'],
+        price_krw=int(vehicle['advertisement']['price']) * 10000,
+        displacement=vehicle['spec']['displacement'],
+        fuel_code=vehicle['spec']['fuelCd'],
+        photo_path=vehicle['photos'][0]['path'],
+    )
+
+
+def _listing_params(listing):
+    """(объем, возраст, мощность, электромобиль, тип топлива, проходное) для расчета по карточке"""
+    engine_volume = listing.displacement
+    # ----- Электричка: в поле объема Encar указывает мощность ---------
+    is_electric = listing.fuel_code == ELECTRIC_FUEL_CODE
+    engine_power = engine_volume if is_electric else DEFAULT_ENGINE_POWER
+    fuel_type = 2 if listing.fuel_code == DIESEL_FUEL_CODE else 1
+    age = get_car_age(listing.year_month)
+    if 'error' in age:
+        raise ValueError(age['error'])
+    return engine_volume, age['year'], engine_power, is_electric, fuel_type, age['is_eligible']
+
+
+def _quote(price_rub, eur_rate, car_age, is_eligible, is_electric, engine_power, personal, resale):
+    return {
+        'price_rub': price_rub,
+        'eur_rate': eur_rate,
+        'car_age': car_age,
+        'is_eligible': is_eligible,
+        'is_electric': is_electric,
+        'engine_power': engine_power,
+        'personal': personal,
+        'resale': resale,
+        'total_personal': price_rub + personal['Итоговая стоимость растаможки'],
+        'total_resale': price_rub + resale['Итоговая стоимость растаможки'],
+    }
+
+
+def quote_listing(listing, snapshot=None):
+    """
+    Расчет растаможки для авто с Encar для физического лица: для себя и для перепродажи.
+
+    :param listing: Результат parse_listing
+    :param snapshot: Снимок курсов (по умолчанию текущий)
+    :return: Словарь с ценой в рублях, возрастом, статусом 'проходное' и обоими расчетами
+    """
+    snapshot = snapshot or get_rate_snapshot()
+    if snapshot is None:
+        raise RuntimeError("Не удалось получить курсы валют")
+    price_rub = snapshot.convert(listing.price_krw, 'KRW', 'RUB')
+    eur_rate = snapshot.to_rub('EUR')
+    engine_volume, car_age, engine_power, is_electric, fuel_type, is_eligible = _listing_params(listing)
+    personal = cached_customs_clearance(price_rub, engine_volume, car_age, engine_power, is_electric, False,
+                                        False, fuel_type, eur_rate)
+    resale = cached_customs_clearance(price_rub, engine_volume, car_age, engine_power, is_electric, False,
+                                      True, fuel_type, eur_rate)
+    return _quote(price_rub, eur_rate, car_age, is_eligible, is_electric, engine_power, personal, resale)
+
+
+def quote_listings(listings, snapshot=None):
+    """
+    quote_listing для списка карточек одним векторным расчетом.
+
+    Оба варианта (для себя и для перепродажи) всех авто считаются одним
+    вызовом calculate_customs_clearance_batch; результаты совпадают с quote_listing.
+
+    :return: Список в порядке listings; на месте карточек с неверной датой выпуска - ValueError
+    """
+    snapshot = snapshot or get_rate_snapshot()
+    if snapshot is None:
+        raise RuntimeError("Не удалось получить курсы валют")
+    eur_rate = snapshot.to_rub('EUR')
+    results = [None] * len(listings)
+    rows = []
+    for i, listing in enumerate(listings):
+        try:
+            params = _listing_params(listing)
+        except ValueError as e:
+            results[i] = e
+            continue
+        rows.append((i, snapshot.convert(listing.price_krw, 'KRW', 'RUB'), *params))
+    if not rows:
+        return results
+    # numpy и векторный расчет нужны только сравнению: страница Streamlit загружается без них
+    import numpy as np
+    from batch_calc import calculate_customs_clearance_batch
+
+    # Первая половина строк пакета - расчет для себя, вторая - для перепродажи
+    index, price, volume, age, power, electric, fuel, eligible = zip(*rows)
+    count = len(rows)
+    price_rub = np.asarray(price * 2, dtype=float)
+    fees = calculate_customs_clearance_batch(price_rub, volume * 2, age * 2, power * 2, electric * 2, False,
+                                             [False] * count + [True] * count, fuel * 2, eur_rate,
+                                             price_eur=price_rub / eur_rate)
+    columns = [fees[key].tolist() for key in FEE_KEYS]
+    for row, i in enumerate(index):
+        personal = {key: column[row] for key, column in zip(FEE_KEYS, columns)}
+        resale = {key: column[row + count] for key, column in zip(FEE_KEYS, columns)}
+        results[i] = _quote(price[row], eur_rate, age[row], eligible[row], electric[row], power[row], personal,
+                            resale)
+    return results
@@ -0,0 +1,208 @@
+import asyncio
+import heapq
+import itertools
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import metrics
+
+# Сервис каталога Encar
+CATALOG_URL = os.environ.get("ENCAR_CATALOG_URL", "http://45.90.216.240:3051/")
+# Таймауты в секундах: на установку соединения и на чтение ответа
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 10
+# Повторы при сетевых ошибках и 5xx с экспоненциальной паузой (0.3, 0.6, 1.2 с)
+MAX_RETRIES = 3
+BACKOFF_FACTOR = 0.3
+# Размер пула keep-alive соединений и предел одновременных запросов к одному каталогу
+POOL_SIZE = 16
+CONCURRENCY = 8
+# Приоритеты запросов: интерактивные (пользователь ждет ответа) обслуживаются раньше пакетных
+INTERACTIVE = 0
+BULK = 1
+
+
+class CatalogError(Exception):
+    """Каталог недоступен или вернул некорректный ответ"""
+
+
+class Ticket:
+    """Место запроса в очереди PriorityLimiter: приоритет можно повысить, пока запрос ждет слот"""
+    __slots__ = ("priority", "entry")
+
+    def __init__(self, priority=INTERACTIVE):
+        self.priority = priority
+        self.entry = None
+
+
+class PriorityLimiter:
+    """
+    Ограничение числа одновременных запросов с очередью по приоритету.
+
+    Если все слоты заняты, ожидающие получают освободившийся слот в порядке
+    (приоритет, время постановки в очередь): интерактивные запросы
+    обгоняют пакетные. Приоритет ожидающего запроса можно повысить (boost).
+    """
+
+    def __init__(self, limit=CONCURRENCY):
+        self.limit = limit
+        self.active = 0
+        self._waiters = []
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+    def acquire(self, priority=INTERACTIVE, ticket=None):
+        """Ждет слот; с ticket приоритет берется из него и может быть повышен во время ожидания"""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                return
+            event = threading.Event()
+            entry = [priority if ticket is None else ticket.priority, next(self._seq), event]
+            if ticket is not None:
+                ticket.entry = entry
+            heapq.heappush(self._waiters, entry)
+        # Слот передается напрямую в release(), active при этом не меняется
+        event.wait()
+
+    def boost(self, ticket, priority):
+        """Повышает приоритет запроса ticket (ждущего слот или еще не вставшего в очередь)"""
+        with self._lock:
+            if priority >= ticket.priority:
+                return
+            ticket.priority = priority
+            entry = ticket.entry
+            if entry is not None and not entry[2].is_set():
+                entry[0] = priority
+                heapq.heapify(self._waiters)
+
+    def release(self):
+        with self._lock:
+            if self._waiters:
+                heapq.heappop(self._waiters)[2].set()
+            else:
+                self.active -= 1
+
+    def waiting(self):
+        return len(self._waiters)
+
+
+class CatalogClient:
+    """
+    Клиент сервиса каталога Encar.
+
+    Держит пул keep-alive соединений, ограничивает время запроса таймаутами и
+    повторяет неудачные запросы с паузой. Одновременные запросы одной и той
+    же карточки (из разных сессий) объединяются в один запрос к каталогу, а
+    общее число запросов к каталогу ограничено concurrency с приоритетом
+    интерактивных запросов над пакетными. Для массовой загрузки есть
+    асинхронный API.
+    """
+
+    def __init__(self, base_url=CATALOG_URL, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT,
+                 max_retries=MAX_RETRIES, backoff_factor=BACKOFF_FACTOR, pool_size=POOL_SIZE,
+                 concurrency=CONCURRENCY):
+        # requests загружается с первым клиентом, а не при импорте модуля: ручной расчет без него стартует быстрее
+        import requests
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.base_url = base_url.rstrip("/") + "/"
+        self.timeout = (connect_timeout, read_timeout)
+        retry = Retry(total=max_retries, connect=max_retries, read=max_retries, status=max_retries,
+                      backoff_factor=backoff_factor, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="catalog")
+        self.limiter = PriorityLimiter(concurrency)
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._coalesced = metrics.counter("customscalc_catalog_coalesced_total")
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def get_json(self, path, params=None, priority=INTERACTIVE, ticket=None):
+        """GET запрос к каталогу, возвращает разобранный JSON"""
+        import requests
+        self.limiter.acquire(priority, ticket)
+        try:
+            with metrics.timed("catalog_request"):
+                response = self.session.get(self.base_url + path, params=params, timeout=self.timeout)
+            # Каталог отвечает 404 с телом {"code": 404}, если авто не найдено
+            if response.status_code != 404:
+                response.raise_for_status()
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError) as e:
+            metrics.upstream_error("catalog")
+            raise CatalogError(f"Ошибка запроса к каталогу {path}: {e}") from e
+        finally:
+            self.limiter.release()
+
+    def get_car(self, car_id, priority=INTERACTIVE):
+        """
+        Карточка автомобиля по CAR_ID ({"code": 404} если не найден).
+
+        Если эта карточка уже запрашивается другим потоком, ждет его ответа
+        (или его CatalogError) вместо повторного запроса к каталогу. Если
+        присоединяется запрос с более высоким приоритетом (пользователь ждет
+        карточку, которую загружает пакет), приоритет общего запроса
+        повышается, и он не стоит в очереди пакетных.
+        """
+        with self._inflight_lock:
+            inflight = self._inflight.get(car_id)
+            leader = inflight is None
+            if leader:
+                inflight = self._inflight[car_id] = (Future(), Ticket(priority))
+        future, ticket = inflight
+        if not leader:
+            self._coalesced.inc()
+            self.limiter.boost(ticket, priority)
+            return future.result()
+        try:
+            future.set_result(self.get_json("catalog", {"car": car_id}, priority, ticket))
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._inflight_lock:
+                del self._inflight[car_id]
+        return future.result()
+
+    async def fetch_car(self, car_id, priority=INTERACTIVE):
+        """Асинхронно загружает карточку автомобиля"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self.get_car, car_id, priority)
+
+    async def fetch_cars(self, car_ids, priority=BULK):
+        """
+        Загружает много карточек параллельно (не больше concurrency запросов клиента одновременно).
+
+        :return: Список в порядке car_ids; на месте неудачных запросов - CatalogError
+        """
+        return await asyncio.gather(*(self.fetch_car(car_id, priority) for car_id in car_ids),
+                                    return_exceptions=True)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Общий клиент каталога процесса (Streamlit и пакетные инструменты)"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = CatalogClient()
+    return _client
@@ -0,0 +1,20 @@
+import os
+import re
+
+# Ссылки на фото объявлений Encar. Отдельный модуль без тяжелых зависимостей:
+# сервис миниатюр (photo_cache.py) не загружает расчет растаможки
+
+# Хост фотографий объявлений (подменяется на standins.photo_server в тестах)
+PHOTO_URL = os.environ.get("ENCAR_PHOTO_URL", "https://ci.encar.com/")
+# Путь фото в карточке: /carpicture08/pic3891/38912345_001.jpg
+_PHOTO_PATH = re.compile(r"^(/[A-Za-z0-9_-]+)+\.jpg$")
+
+
+def get_photo_url(photo_path):
+    """Ссылка на главное фото объявления на ci.encar.com"""
+    return PHOTO_URL + 'carpicture' + photo_path[0:-7] + '001.jpg' + \
+        '?impolicy=heightRate&rh=696&cw=1160&ch=696&cg=Center '
+
+
+def is_photo_path(photo_path):
+    return bool(_PHOTO_PATH.match(photo_path))
@@ -0,0 +1,187 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import fields
+
+import metrics
+from encar import Listing, parse_listing
+from encar_client import get_client
+
+# Локальное хранилище карточек Encar, общее для всех процессов на машине
+LISTING_STORE_FILE = os.environ.get("LISTING_STORE_FILE", "listing_store.sqlite3")
+# Время жизни найденной карточки (как было у st.cache_data) и отметки "не найдено" (в секундах)
+LISTING_TTL = 84600
+NOT_FOUND_TTL = 10 * 60
+# Ограничение размера хранилища (сумма размеров записей, в байтах)
+MAX_BYTES = 16 * 1024 * 1024
+# Время последнего обращения обновляется не чаще, чем раз в TOUCH_INTERVAL секунд
+TOUCH_INTERVAL = 60
+
+_FIELDS = tuple(f.name for f in fields(Listing))
+
+# Сумма размеров записей хранится в listings_size и поддерживается триггерами: проверка
+# бюджета при записи - чтение одной строки, и счетчик верен для всех процессов с этим файлом
+_SCHEMA = """
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS listings (
+    car_id TEXT PRIMARY KEY,
+    data TEXT,
+    size INTEGER NOT NULL,
+    expires_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS listings_accessed_at ON listings (accessed_at);
+CREATE TABLE IF NOT EXISTS listings_size (id INTEGER PRIMARY KEY CHECK (id = 0), total INTEGER NOT NULL);
+INSERT OR IGNORE INTO listings_size SELECT 0, COALESCE(SUM(size), 0) FROM listings;
+CREATE TRIGGER IF NOT EXISTS listings_size_insert AFTER INSERT ON listings BEGIN
+    UPDATE listings_size SET total = total + NEW.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS listings_size_delete AFTER DELETE ON listings BEGIN
+    UPDATE listings_size SET total = total - OLD.size WHERE id = 0;
+END;
+CREATE TRIGGER IF NOT EXISTS listings_size_update AFTER UPDATE OF size ON listings BEGIN
+    UPDATE listings_size SET total = total + NEW.size - OLD.size WHERE id = 0;
+END;
+COMMIT;
+"""
+# INSERT OR REPLACE удаляет старую строку без триггера DELETE, поэтому повторная запись - UPSERT
+_UPSERT = """
+INSERT INTO listings VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (car_id) DO UPDATE SET data = excluded.data, size = excluded.size, expires_at = excluded.expires_at,
+                                   accessed_at = excluded.accessed_at
+"""
+
+
+def _dump(listing):
+    # Значения полей по порядку, без имен: запись в несколько раз меньше исходного JSON каталога
+    return json.dumps([getattr(listing, name) for name in _FIELDS], ensure_ascii=False, separators=(",", ":"))
+
+
+def _load(data):
+    return Listing(*json.loads(data))
+
+
+class ListingStore:
+    """
+    Хранилище карточек Encar (SQLite), ключ - CAR_ID.
+
+    Хранится только Listing, а не весь ответ каталога. Записи живут ttl
+    секунд; отметка "авто не найдено" - not_found_ttl секунд. Когда сумма
+    размеров записей превышает max_bytes, удаляются сначала просроченные,
+    затем давно не запрашиваемые записи (LRU). Файл базы можно открывать из
+    нескольких процессов одновременно.
+    """
+
+    def __init__(self, path=LISTING_STORE_FILE, ttl=LISTING_TTL, not_found_ttl=NOT_FOUND_TTL, max_bytes=MAX_BYTES):
+        self.path = path
+        self.ttl = ttl
+        self.not_found_ttl = not_found_ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self):
+        self._conn.close()
+
+    def lookup(self, car_id, now=None):
+        """
+        Ищет карточку в хранилище.
+
+        :return: (найдено ли в хранилище, Listing или None если авто не существует)
+        """
+        now = time.time() if now is None else now
+        with self._lock:
+            row = self._conn.execute("SELECT data, expires_at, accessed_at FROM listings WHERE car_id = ?",
+                                     (car_id,)).fetchone()
+            if row is None or row[1] <= now:
+                metrics.cache_hit("listing", False)
+                return False, None
+            if now - row[2] > TOUCH_INTERVAL:
+                self._conn.execute("UPDATE listings SET accessed_at = ? WHERE car_id = ?", (now, car_id))
+        metrics.cache_hit("listing", True)
+        return True, None if row[0] is None else _load(row[0])
+
+    def put(self, car_id, listing, now=None):
+        """Сохраняет карточку (None - авто не найдено) и при необходимости освобождает место"""
+        now = time.time() if now is None else now
+        data = None if listing is None else _dump(listing)
+        ttl = self.not_found_ttl if listing is None else self.ttl
+        size = len(car_id) + (len(data.encode()) if data else 0)
+        with self._lock:
+            self._conn.execute(_UPSERT, (car_id, data, size, now + ttl, now))
+            self._evict(now)
+
+    def _total_size(self):
+        return self._conn.execute("SELECT total FROM listings_size WHERE id = 0").fetchone()[0]
+
+    def _evict(self, now):
+        if self._total_size() <= self.max_bytes:
+            return
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.execute("DELETE FROM listings WHERE expires_at <= ?", (now,))
+            total = self._total_size()
+            if total > self.max_bytes:
+                # Удаляем самые давние по обращению записи, пока не уложимся в бюджет
+                freed = 0
+                victims = []
+                for car_id, size in self._conn.execute("SELECT car_id, size FROM listings ORDER BY accessed_at"):
+                    if total - freed <= self.max_bytes:
+                        break
+                    victims.append((car_id,))
+                    freed += size
+                self._conn.executemany("DELETE FROM listings WHERE car_id = ?", victims)
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+    def get_or_load(self, car_id, load):
+        """
+        Карточка из хранилища или из load(car_id) с сохранением результата.
+
+        load возвращает Listing или None (авто не найдено); исключения load
+        (например, CatalogError) не кэшируются.
+        """
+        hit, listing = self.lookup(car_id)
+        if hit:
+            return listing
+        listing = load(car_id)
+        self.put(car_id, listing)
+        return listing
+
+    def stats(self):
+        """Количество записей, из них "не найдено", и суммарный размер"""
+        with self._lock:
+            count, not_found = self._conn.execute("SELECT COUNT(*), COUNT(*) - COUNT(data) FROM listings").fetchone()
+            size = self._total_size()
+        return {"count": count, "not_found": not_found, "bytes": size, "max_bytes": self.max_bytes}
+
+
+def fetch_listing(car_id):
+    """Загружает карточку из каталога Encar, минуя хранилище"""
+    return parse_listing(get_client().get_car(car_id))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Хранилище карточек по умолчанию (LISTING_STORE_FILE)"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = ListingStore()
+    return _store
+
+
+def load_listing(car_id):
+    """Карточка авто по CAR_ID: из хранилища или из каталога Encar. None, если авто не найдено"""
+    return get_store().get_or_load(car_id, fetch_listing)
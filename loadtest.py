@@ -0,0 +1,306 @@
+# Нагрузочный тест app.py: один сервер Streamlit и много одновременных сессий
+# браузера (websocket /_stcore/stream) против локальных заменителей каталога
+# Encar и сайта ЦБ (standins) с настраиваемой задержкой ответа.
+#
+#   python loadtest.py --sessions 16 --iterations 5 --flow mixed --catalog-latency 0.3
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+from standins import catalog_server, cbr_server, load_fixture
+
+APP_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+SESSIONS = 8
+ITERATIONS = 5
+# Сценарии: ручной расчет, поиск авто с Encar, сессии поровну обоих видов
+FLOWS = ("manual", "encar", "mixed")
+# Предел ожидания запуска сервера и одного перезапуска скрипта (в секундах)
+STARTUP_TIMEOUT = 60
+RERUN_TIMEOUT = 60
+
+
+class AppSession:
+    """
+    Сессия браузера: отправляет BackMsg rerun_script с состоянием виджетов
+    и читает ForwardMsg до script_finished, как фронтенд Streamlit.
+
+    Виджеты ищутся по подписи; изменение значения и нажатие кнопки внутри
+    st.fragment перезапускают только этот фрагмент.
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.widgets = {}
+        self.latencies = []
+        self._states = {}
+        self._ws = None
+
+    async def connect(self):
+        import websockets
+
+        self._ws = await websockets.connect(self.url, subprotocols=["streamlit"], max_size=None)
+        await self.rerun()
+
+    async def close(self):
+        if self._ws is not None:
+            await self._ws.close()
+
+    async def rerun(self, fragment_id="", trigger=None):
+        """Перезапуск скрипта (или фрагмента); время до script_finished попадает в latencies"""
+        from streamlit.proto.BackMsg_pb2 import BackMsg
+        from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+
+        msg = BackMsg()
+        msg.rerun_script.query_string = ""
+        msg.rerun_script.page_script_hash = ""
+        msg.rerun_script.fragment_id = fragment_id
+        msg.rerun_script.widget_states.widgets.extend(self._states.values())
+        if trigger is not None:
+            msg.rerun_script.widget_states.widgets.append(trigger)
+        if not fragment_id:
+            self.widgets.clear()
+        errors = []
+        start = time.perf_counter()
+        await self._ws.send(msg.SerializeToString())
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await asyncio.wait_for(self._ws.recv(), RERUN_TIMEOUT))
+            kind = forward.WhichOneof("type")
+            if kind == "delta" and forward.delta.WhichOneof("type") == "new_element":
+                element = forward.delta.new_element
+                name = element.WhichOneof("type")
+                value = getattr(element, name)
+                if name == "exception":
+                    errors.append(value.message)
+                elif getattr(value, "id", ""):
+                    self.widgets[value.label] = (value.id, forward.delta.fragment_id)
+            elif kind == "script_finished":
+                self.latencies.append(time.perf_counter() - start)
+                if forward.script_finished == ForwardMsg.FINISHED_WITH_COMPILE_ERROR:
+                    errors.append("ошибка компиляции app.py")
+                break
+        if errors:
+            raise RuntimeError(errors[0])
+
+    def _widget_state(self, label):
+        from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+        widget_id, fragment_id = self.widgets[label]
+        state = WidgetState()
+        state.id = widget_id
+        return state, fragment_id
+
+    async def set_value(self, label, value):
+        """Меняет значение виджета (bool, int, float или str) и перезапускает его раздел"""
+        state, fragment_id = self._widget_state(label)
+        if isinstance(value, bool):
+            state.bool_value = value
+        elif isinstance(value, int):
+            state.int_value = value
+        elif isinstance(value, float):
+            state.double_value = value
+        else:
+            state.string_value = value
+        self._states[state.id] = state
+        await self.rerun(fragment_id)
+
+    async def click(self, label):
+        state, fragment_id = self._widget_state(label)
+        state.trigger_value = True
+        await self.rerun(fragment_id, state)
+
+
+async def manual_session(session, rng, iterations):
+    """Ручной расчет: меняется цена авто и нажимается 'Рассчитать'"""
+    for _ in range(iterations):
+        await session.set_value('Стоимость автомобиля', rng.randrange(5_000, 80_000, 100))
+        await session.click('Рассчитать')
+
+
+async def encar_session(session, rng, iterations, car_ids):
+    """Поиск на Encar: вводится CAR_ID (в том числе несуществующий) и нажимается 'Найти'"""
+    await session.set_value('Хочу посчитать машину с Encar', True)
+    for _ in range(iterations):
+        await session.set_value('Вставьте ссылку на Encar или id авто', rng.choice(car_ids))
+        await session.click('Найти')
+
+
+async def run_session(session, index, flow, iterations, seed, car_ids):
+    """Сценарий одной сессии; возвращает текст ошибки или None"""
+    rng = random.Random(seed + index)
+    if flow == "mixed":
+        flow = FLOWS[index % 2]
+    try:
+        await session.connect()
+        if flow == "manual":
+            await manual_session(session, rng, iterations)
+        else:
+            await encar_session(session, rng, iterations, car_ids)
+    except Exception as e:
+        return f"{type(e).__name__}: {e}"
+    return None
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _rss_bytes(pid):
+    """Резидентная память процесса (Linux, /proc) или None"""
+    try:
+        with open(f"/proc/{pid}/status", "r", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def start_app(port, env, cwd):
+    """Запускает streamlit run app.py и ждет, пока сервер начнет отвечать"""
+    process = subprocess.Popen(
+        [sys.executable, "-m", "streamlit", "run", APP_FILE, "--server.headless", "true",
+         "--server.port", str(port), "--browser.gatherUsageStats", "false"],
+        cwd=cwd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Сервер Streamlit завершился: {process.stderr.read().decode(errors='replace')}")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1):
+                return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"Сервер Streamlit не ответил за {STARTUP_TIMEOUT} с")
+
+
+def _percentile(values, p):
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def _drive(url, pid, sessions, iterations, flow, seed, car_ids):
+    # Первая сессия отдельно: импорт модулей приложения и загрузка курсов
+    warmup = AppSession(url)
+    error = await run_session(warmup, -1, "manual", 1, seed, car_ids)
+    await warmup.close()
+    if error:
+        raise RuntimeError(f"Первая сессия завершилась ошибкой: {error}")
+    rss_before = _rss_bytes(pid)
+
+    clients = [AppSession(url) for _ in range(sessions)]
+    start = time.perf_counter()
+    errors = await asyncio.gather(*(run_session(client, i, flow, iterations, seed, car_ids)
+                                    for i, client in enumerate(clients)))
+    wall = time.perf_counter() - start
+    # Сессии еще подключены: их состояние держится в памяти сервера
+    rss_after = _rss_bytes(pid)
+    await asyncio.gather(*(client.close() for client in clients))
+    memory = None if rss_before is None or rss_after is None else (rss_after - rss_before) / sessions
+    return warmup.latencies[0], clients, [error for error in errors if error], wall, memory
+
+
+def run_load(sessions=SESSIONS, iterations=ITERATIONS, flow="mixed", catalog_latency=0.0, cbr_latency=0.0,
+             seed=0, port=None):
+    """
+    Запускает app.py и sessions одновременных сессий, собирает статистику.
+
+    Сервер получает адреса заменителей через ENCAR_CATALOG_URL и CBR_URL и
+    работает во временном каталоге: кэш курсов и хранилище карточек пустые,
+    поэтому первая сессия загружает курсы с заменителя ЦБ.
+
+    :return: Словарь с результатами (задержки - в миллисекундах)
+    """
+    if flow not in FLOWS:
+        raise ValueError(f"Неизвестный сценарий: {flow}. Допустимые: {', '.join(FLOWS)}")
+    car_ids = list(load_fixture("encar_catalog.json")) + ["10000000"]
+    port = port or _free_port()
+    workdir = tempfile.mkdtemp(prefix="customscalc-loadtest-")
+    with catalog_server(latency=catalog_latency) as catalog, cbr_server(latency=cbr_latency) as cbr:
+        env = dict(os.environ, ENCAR_CATALOG_URL=catalog.url, CBR_URL=cbr.url)
+        env.setdefault("CUSTOMSCALC_METRICS", "0")
+        process = start_app(port, env, workdir)
+        try:
+            first_run, clients, errors, wall, memory = asyncio.run(
+                _drive(f"ws://127.0.0.1:{port}/_stcore/stream", process.pid, sessions, iterations, flow, seed,
+                       car_ids))
+        finally:
+            process.terminate()
+            process.wait()
+        catalog_requests, cbr_requests = catalog.requests, cbr.requests
+
+    latencies = sorted(latency for client in clients for latency in client.latencies)
+    return {
+        "sessions": sessions,
+        "iterations": iterations,
+        "flow": flow,
+        "catalog_latency": catalog_latency,
+        "cbr_latency": cbr_latency,
+        "first_run_ms": first_run * 1000,
+        "wall_s": wall,
+        "reruns": len(latencies),
+        "reruns_per_sec": len(latencies) / wall if wall else 0.0,
+        "p50_ms": _percentile(latencies, 0.50) * 1000 if latencies else None,
+        "p95_ms": _percentile(latencies, 0.95) * 1000 if latencies else None,
+        "p99_ms": _percentile(latencies, 0.99) * 1000 if latencies else None,
+        "max_ms": latencies[-1] * 1000 if latencies else None,
+        "memory_per_session_kb": memory / 1024 if memory is not None else None,
+        "catalog_requests": catalog_requests,
+        "cbr_requests": cbr_requests,
+        "errors": errors,
+    }
+
+
+def print_report(report):
+    def ms(value):
+        return "-" if value is None else f"{value:,.1f} мс"
+
+    print(f"Сценарий: {report['flow']}, сессий: {report['sessions']}, шагов в сессии: {report['iterations']}, "
+          f"задержка каталога/ЦБ: {report['catalog_latency']}/{report['cbr_latency']} с")
+    print(f"Первый запуск:            {ms(report['first_run_ms'])}")
+    print(f"Перезапусков:             {report['reruns']} за {report['wall_s']:.2f} с "
+          f"({report['reruns_per_sec']:.1f} в секунду)")
+    print(f"Задержка p50/p95/p99/max: {ms(report['p50_ms'])} / {ms(report['p95_ms'])} / "
+          f"{ms(report['p99_ms'])} / {ms(report['max_ms'])}")
+    if report["memory_per_session_kb"] is not None:
+        print(f"Память на сессию:         {report['memory_per_session_kb']:,.0f} КБ")
+    print(f"Запросов к каталогу/ЦБ:   {report['catalog_requests']} / {report['cbr_requests']}")
+    print(f"Ошибок:                   {len(report['errors'])}")
+    for error in report["errors"][:5]:
+        print(f"  {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Нагрузочный тест app.py на локальных заменителях Encar и ЦБ")
+    parser.add_argument("--sessions", type=int, default=SESSIONS, help="Одновременных сессий")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS, help="Расчетов в каждой сессии")
+    parser.add_argument("--flow", choices=FLOWS, default="mixed", help="Сценарий сессий")
+    parser.add_argument("--catalog-latency", type=float, default=0.0, help="Задержка ответа каталога, с")
+    parser.add_argument("--cbr-latency", type=float, default=0.0, help="Задержка ответа ЦБ, с")
+    parser.add_argument("--seed", type=int, default=0, help="Зерно случайных входных данных")
+    parser.add_argument("--port", type=int, help="Порт сервера Streamlit (по умолчанию свободный)")
+    parser.add_argument("--save", help="Сохранить результаты в JSON")
+    args = parser.parse_args(argv)
+
+    report = run_load(args.sessions, args.iterations, args.flow, args.catalog_latency, args.cbr_latency, args.seed,
+                      args.port)
+    print_report(report)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,235 @@
+import os
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Сбор метрик можно отключить переменной окружения CUSTOMSCALC_METRICS=0
+METRICS_ENABLED = os.environ.get("CUSTOMSCALC_METRICS", "1") != "0"
+METRICS_PORT = int(os.environ.get("CUSTOMSCALC_METRICS_PORT", "9108"))
+# Границы корзин гистограммы задержек (в секундах)
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными корзинами (как в Prometheus)"""
+    __slots__ = ('counts', 'sum', 'count', '_lock')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        i = bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.counts[i] += 1
+            self.sum += seconds
+            self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля линейной интерполяцией внутри корзины"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - seen) / n
+            seen += n
+        return BUCKETS[-1]
+
+
+class Counter:
+    """
+    Счетчик без блокировки: увеличение - одна операция на горячем пути.
+    При одновременных увеличениях из разных потоков редкие потери отсчета допустимы.
+    """
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, value=1):
+        if METRICS_ENABLED:
+            self.value += value
+
+
+_histograms = {}
+_counters = {}
+_lock = threading.Lock()
+
+
+def observe(stage, seconds):
+    """Записывает длительность этапа"""
+    if not METRICS_ENABLED:
+        return
+    histogram = _histograms.get(stage)
+    if histogram is None:
+        with _lock:
+            histogram = _histograms.setdefault(stage, Histogram())
+    histogram.observe(seconds)
+
+
+def counter(name, **labels):
+    """Счетчик name с метками labels (один и тот же объект при повторных вызовах)"""
+    key = (name, tuple(sorted(labels.items())))
+    value = _counters.get(key)
+    if value is None:
+        with _lock:
+            value = _counters.setdefault(key, Counter())
+    return value
+
+
+def inc(name, value=1, **labels):
+    """Увеличивает счетчик name с метками labels"""
+    counter(name, **labels).inc(value)
+
+
+_cache_counters = {}
+
+
+def cache_hit(cache, hit):
+    """Отмечает попадание или промах кэша"""
+    value = _cache_counters.get((cache, hit))
+    if value is None:
+        value = _cache_counters[cache, hit] = counter("customscalc_cache_requests_total", cache=cache,
+                                                      result="hit" if hit else "miss")
+    value.inc()
+
+
+def upstream_error(upstream):
+    """Отмечает ошибку внешнего сервиса (cbr, catalog, ...)"""
+    inc("customscalc_upstream_errors_total", upstream=upstream)
+
+
+class timed:
+    """
+    Замер длительности этапа: контекстный менеджер или декоратор.
+
+        with timed("catalog_fetch"):
+            ...
+    """
+    __slots__ = ('stage', '_start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self._start)
+
+    def __call__(self, func):
+        stage = self.stage
+
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                observe(stage, time.perf_counter() - start)
+
+        wrapper.__name__ = func.__name__
+        wrapper.__doc__ = func.__doc__
+        wrapper.__wrapped__ = func
+        return wrapper
+
+
+def _labels(pairs):
+    return ",".join(f'{name}="{value}"' for name, value in pairs)
+
+
+def render_prometheus():
+    """Все метрики в текстовом формате Prometheus"""
+    lines = [
+        "# HELP customscalc_stage_seconds Длительность этапов расчета",
+        "# TYPE customscalc_stage_seconds histogram",
+    ]
+    with _lock:
+        histograms = sorted(_histograms.items())
+        counters = sorted((key, value.value) for key, value in _counters.items())
+    for stage, histogram in histograms:
+        cumulative = 0
+        for bound, n in zip(BUCKETS, histogram.counts):
+            cumulative += n
+            lines.append(f'customscalc_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+        lines.append(f'customscalc_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {histogram.count}')
+        lines.append(f'customscalc_stage_seconds_sum{{stage="{stage}"}} {histogram.sum}')
+        lines.append(f'customscalc_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+    lines.append("# HELP customscalc_stage_quantile_seconds Оценка p50/p95/p99 длительности этапов")
+    lines.append("# TYPE customscalc_stage_quantile_seconds gauge")
+    for stage, histogram in histograms:
+        for q in QUANTILES:
+            lines.append(f'customscalc_stage_quantile_seconds{{stage="{stage}",quantile="{q}"}} '
+                         f'{histogram.quantile(q)}')
+
+    names = []
+    for (name, labels), value in counters:
+        if name not in names:
+            names.append(name)
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{{{_labels(labels)}}} {value}")
+
+    # Доля попаданий по каждому кэшу
+    caches = {}
+    for (name, labels), value in counters:
+        if name == "customscalc_cache_requests_total":
+            labels = dict(labels)
+            hits, total = caches.get(labels["cache"], (0, 0))
+            caches[labels["cache"]] = (hits + (value if labels["result"] == "hit" else 0), total + value)
+    if caches:
+        lines.append("# TYPE customscalc_cache_hit_ratio gauge")
+        for cache, (hits, total) in sorted(caches.items()):
+            lines.append(f'customscalc_cache_hit_ratio{{cache="{cache}"}} {hits / total if total else 0.0}')
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_error = None
+
+
+def start_metrics_server(port=METRICS_PORT, host="127.0.0.1"):
+    """
+    Запускает локальный HTTP-эндпоинт /metrics в фоновом потоке.
+
+    Повторный вызов (например, при перезапуске скрипта Streamlit) ничего не
+    делает. Возвращает сервер или None, если метрики отключены или порт занят.
+    """
+    global _server, _server_error
+    if not METRICS_ENABLED:
+        return None
+    with _lock:
+        if _server is not None or _server_error is not None:
+            return _server
+        try:
+            _server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            _server_error = e
+            print(f"Не удалось запустить сервер метрик на порту {port}: {e}")
+            return None
+        _server.daemon_threads = True
+        threading.Thread(target=_server.serve_forever, name="metrics", daemon=True).start()
+        return _server
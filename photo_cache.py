@@ -0,0 +1,269 @@
+import argparse
+import hashlib
+import io
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+import requests
+import uvicorn
+from requests.adapters import HTTPAdapter
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from urllib3.util.retry import Retry
+
+import metrics
+from encar_photos import get_photo_url, is_photo_path
+from encar_client import BACKOFF_FACTOR, CONNECT_TIMEOUT, MAX_RETRIES, READ_TIMEOUT
+
+# Каталог миниатюр и ограничение его размера (в байтах)
+PHOTO_CACHE_DIR = os.environ.get("PHOTO_CACHE_DIR", "photo_cache")
+MAX_BYTES = 256 * 1024 * 1024
+# Миниатюра вписывается в квадрат THUMBNAIL_SIZE (app.py показывает фото шириной 300, x2 для HiDPI)
+THUMBNAIL_SIZE = 600
+JPEG_QUALITY = 80
+# Фото объявления не меняется: браузер может хранить его год
+CACHE_CONTROL = "public, max-age=31536000, immutable"
+# Размер пула соединений к хосту фотографий
+POOL_SIZE = 16
+# Предел размера загружаемого фото (в байтах): больший ответ не читается дальше и не разбирается
+MAX_DOWNLOAD_BYTES = 20 * 1024 * 1024
+# Размер порции при чтении ответа
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+
+class PhotoError(Exception):
+    """Фото не удалось загрузить с Encar или разобрать"""
+
+
+def photo_key(photo_path):
+    """Имя файла миниатюры"""
+    return hashlib.sha1(photo_path.encode()).hexdigest() + ".jpg"
+
+
+def make_thumbnail(data, size=THUMBNAIL_SIZE, quality=JPEG_QUALITY):
+    """Уменьшенная и пережатая в JPEG копия изображения"""
+    from PIL import Image  # Pillow нужен только сервису фотографий
+
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Для JPEG декодер сразу уменьшает изображение в 2-8 раз, это намного быстрее полного разбора
+            image.draft("RGB", (size, size))
+            image.thumbnail((size, size))
+            if image.mode != "RGB":
+                image = image.convert("RGB")
+            buffer = io.BytesIO()
+            image.save(buffer, "JPEG", quality=quality, optimize=True, progressive=True)
+    except Image.DecompressionBombError as e:
+        # Не наследует OSError/ValueError: слишком большое изображение - такая же ошибка разбора
+        raise ValueError(str(e)) from e
+    return buffer.getvalue()
+
+
+def _read_limited(response, limit, photo_path):
+    """Тело ответа, прочитанное порциями; PhotoError, как только оно длиннее limit байт"""
+    too_large = PhotoError(f"Фото {photo_path} больше {limit} байт")
+    if response.headers.get("Content-Length", "").isdigit() and int(response.headers["Content-Length"]) > limit:
+        raise too_large
+    chunks = []
+    size = 0
+    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+        size += len(chunk)
+        if size > limit:
+            raise too_large
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+class PhotoCache:
+    """
+    Миниатюры фото объявлений на локальном диске.
+
+    Каждое фото загружается с Encar один раз (одновременные запросы одного
+    фото объединяются), уменьшается до THUMBNAIL_SIZE и сохраняется в
+    directory. Когда сумма размеров файлов превышает max_bytes, удаляются
+    давно не запрашиваемые миниатюры (LRU; порядок хранится во времени
+    изменения файлов и переживает перезапуск). Каталог рассчитан на один
+    процесс сервиса.
+    """
+
+    def __init__(self, directory=PHOTO_CACHE_DIR, max_bytes=MAX_BYTES, size=THUMBNAIL_SIZE, quality=JPEG_QUALITY):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = size
+        self.quality = quality
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._entries = OrderedDict()
+        self.bytes = 0
+        files = []
+        for entry in os.scandir(directory):
+            if entry.is_file() and entry.name.endswith(".jpg"):
+                stat = entry.stat()
+                files.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(files):
+            self._entries[name] = size
+            self.bytes += size
+
+        retry = Retry(total=MAX_RETRIES, connect=MAX_RETRIES, read=MAX_RETRIES, status=MAX_RETRIES,
+                      backoff_factor=BACKOFF_FACTOR, status_forcelist=(500, 502, 503, 504),
+                      allowed_methods=frozenset(["GET"]), raise_on_status=False)
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, photo_path):
+        """Миниатюра фото (байты JPEG): с диска или с Encar"""
+        key = photo_key(photo_path)
+        data = self._read(key)
+        if data is not None:
+            metrics.cache_hit("photo", True)
+            return data
+        metrics.cache_hit("photo", False)
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            return future.result()
+        try:
+            data = self._fetch(photo_path)
+            self._store(key, data)
+            future.set_result(data)
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+        return future.result()
+
+    def _read(self, key):
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+        path = os.path.join(self.directory, key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            # Файл удален снаружи: миниатюра будет загружена заново
+            with self._lock:
+                self.bytes -= self._entries.pop(key, 0)
+            return None
+        return data
+
+    def _fetch(self, photo_path):
+        try:
+            with metrics.timed("photo_fetch"):
+                with self.session.get(get_photo_url(photo_path), timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                      stream=True) as response:
+                    response.raise_for_status()
+                    data = _read_limited(response, MAX_DOWNLOAD_BYTES, photo_path)
+            with metrics.timed("photo_resize"):
+                return make_thumbnail(data, self.size, self.quality)
+        except requests.exceptions.RequestException as e:
+            metrics.upstream_error("photo")
+            raise PhotoError(f"Ошибка загрузки фото {photo_path}: {e}") from e
+        except (OSError, ValueError) as e:
+            # Pillow не смог разобрать ответ
+            raise PhotoError(f"Не удалось обработать фото {photo_path}: {e}") from e
+
+    def _store(self, key, data):
+        """Атомарно записывает миниатюру и удаляет давно не запрашиваемые сверх max_bytes"""
+        fd, tmp_path = tempfile.mkstemp(prefix=".photo.", suffix=".tmp", dir=self.directory)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, os.path.join(self.directory, key))
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        evicted = []
+        with self._lock:
+            self.bytes += len(data) - self._entries.pop(key, 0)
+            self._entries[key] = len(data)
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                name, size = self._entries.popitem(last=False)
+                self.bytes -= size
+                evicted.append(name)
+        for name in evicted:
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except OSError:
+                pass
+        if evicted:
+            metrics.inc("customscalc_photo_evictions_total", len(evicted))
+
+    def stats(self):
+        return {"count": len(self._entries), "bytes": self.bytes, "max_bytes": self.max_bytes}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_photo_cache():
+    """Кэш миниатюр по умолчанию (PHOTO_CACHE_DIR)"""
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = PhotoCache()
+    return _cache
+
+
+# ---------- Сервис ----------
+
+async def photo(request):
+    """GET /photo/<путь фото из карточки Encar> - миниатюра с долгим кэшированием в браузере"""
+    photo_path = "/" + request.path_params["photo_path"]
+    if not is_photo_path(photo_path):
+        return PlainTextResponse("Неверный путь фото", 400)
+    key = photo_key(photo_path)
+    headers = {"Cache-Control": CACHE_CONTROL, "ETag": f'"{key[:-4]}"'}
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    try:
+        data = await run_in_threadpool(get_photo_cache().get, photo_path)
+    except PhotoError as e:
+        return PlainTextResponse(str(e), 502)
+    return Response(data, media_type="image/jpeg", headers=headers)
+
+
+async def health(request):
+    return JSONResponse({"status": "ok", "photos": get_photo_cache().stats()})
+
+
+app = Starlette(
+    routes=[
+        Route("/photo/{photo_path:path}", photo),
+        Route("/health", health),
+    ],
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сервис миниатюр фото объявлений Encar")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8601)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+import threading
+from collections import OrderedDict
+
+import metrics
+
+from config import calculate_customs_clearance
+from currency_converter import get_rate_snapshot, get_snapshot_on
+from tariffs import get_schedule
+
+# Максимальное количество расчетов в кэше
+QUOTE_CACHE_SIZE = 4096
+
+
+class QuoteCache:
+    """
+    Ограниченный LRU-кэш результатов расчета растаможки.
+
+    Ключ - нормализованные входные данные; записи хранятся вместе с версией
+    курсов и находятся только по той же версии. Кэш не очищается при смене
+    версии: если старый и новый снимок курсов чередуются (обновление курсов
+    ЦБ между сессиями), расчеты для обоих остаются, а записи версий, которые
+    больше не запрашиваются, вытесняются как давно не использованные.
+    Версия тарифов входит в ключ (cached_customs_clearance).
+    Общий для всех сессий процесса, потокобезопасный.
+    """
+
+    def __init__(self, maxsize=QUOTE_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, version):
+        """Возвращает сохраненный результат или None"""
+        with self._lock:
+            key = (version, key)
+            value = self._data.get(key)
+            metrics.cache_hit("quote", value is not None)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key, version, value):
+        with self._lock:
+            key = (version, key)
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def get_or_compute(self, key, version, compute):
+        """Возвращает результат из кэша или считает его через compute() и сохраняет"""
+        value = self.get(key, version)
+        if value is not None:
+            return value
+        value = compute()
+        self.put(key, version, value)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        """Счетчики кэша: размер, попадания, промахи и доля попаданий"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+
+# Кэш по умолчанию, общий для всех сессий Streamlit в процессе
+quote_cache = QuoteCache()
+
+
+def quote_key(car_price_rub, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+              is_commercial=False, fuel_type=1, exchange_rate=None, on_date=None):
+    """Нормализованный ключ расчета (одинаковые по смыслу входные данные дают один ключ)"""
+    return (float(car_price_rub), float(engine_volume), float(car_age), float(engine_power), bool(is_electric),
+            bool(is_legal_entity), bool(is_commercial), fuel_type,
+            None if exchange_rate is None else float(exchange_rate),
+            None if on_date is None else str(on_date)[:10])
+
+
+def cached_customs_clearance(car_price_rub, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                             is_commercial=False, fuel_type=1, exchange_rate=None, on_date=None, cache=None):
+    """
+    calculate_customs_clearance с кэшированием результата.
+
+    Принимает те же параметры. Возвращает копию сохраненного словаря, поэтому
+    вызывающий код может его изменять.
+    """
+    if cache is None:
+        cache = quote_cache
+    snapshot = get_rate_snapshot()
+    version = snapshot.version if snapshot is not None else None
+    key = quote_key(car_price_rub, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                    is_commercial, fuel_type, exchange_rate, on_date)
+    # Расчет зависит от версии тарифов на дату декларирования
+    key += (get_schedule(on_date).version,)
+    if on_date is not None:
+        # Расчет на дату зависит от курсов на эту дату
+        history_snapshot = get_snapshot_on(on_date)
+        key += (history_snapshot.version if history_snapshot is not None else None,)
+    result = cache.get_or_compute(key, version, lambda: calculate_customs_clearance(
+        car_price_rub, engine_volume, car_age, engine_power, is_electric, is_legal_entity, is_commercial, fuel_type,
+        exchange_rate, on_date))
+    return dict(result)
@@ -0,0 +1,188 @@
+import argparse
+import json
+import sqlite3
+import threading
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+import requests
+
+from currency_converter import RateSnapshot
+
+# Локальное хранилище исторических курсов ЦБ
+HISTORY_FILE = "rate_history.sqlite3"
+# Архив ежедневных курсов: курсы, действующие на указанную дату
+ARCHIVE_URL = "https://www.cbr-xml-daily.ru/archive/{date:%Y/%m/%d}/daily_json.js"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rates (
+    rate_date TEXT NOT NULL,
+    code TEXT NOT NULL,
+    value REAL NOT NULL,
+    nominal INTEGER NOT NULL,
+    PRIMARY KEY (rate_date, code)
+) WITHOUT ROWID
+"""
+
+
+def to_date(value):
+    """Приводит date, datetime или строку "YYYY-MM-DD" к date"""
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+class RateHistory:
+    """
+    Хранилище курсов ЦБ по датам (SQLite).
+
+    Записи только добавляются: курс на уже сохраненную дату не
+    перезаписывается. Список дат держится в памяти отсортированным, поэтому
+    поиск курса на дату - бинарный поиск без обращения к базе, а снимки
+    курсов на дату кэшируются.
+    """
+
+    def __init__(self, path=HISTORY_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._dates = None
+        self._snapshot_for = lru_cache(maxsize=512)(self._load_snapshot)
+
+    def close(self):
+        self._conn.close()
+
+    def add(self, rate_date, rates):
+        """
+        Добавляет курсы на дату.
+
+        :param rates: Словарь в формате ЦБ {"USD": {"Value": ..., "Nominal": ...}, ...}
+        :return: Количество новых записей
+        """
+        rate_date = to_date(rate_date).isoformat()
+        rows = [(rate_date, code, currency["Value"], currency["Nominal"]) for code, currency in rates.items()]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany("INSERT OR IGNORE INTO rates VALUES (?, ?, ?, ?)", rows)
+            self._conn.commit()
+            inserted = self._conn.total_changes - before
+            if inserted:
+                self._dates = None
+                self._snapshot_for.cache_clear()
+        return inserted
+
+    def import_daily_json(self, data):
+        """Добавляет курсы из ответа ЦБ (daily_json.js) на дату из поля "Date" """
+        return self.add(data["Date"], data["Valute"])
+
+    def dates(self):
+        """Отсортированный список дат, на которые есть курсы"""
+        dates = self._dates
+        if dates is None:
+            with self._lock:
+                rows = self._conn.execute("SELECT DISTINCT rate_date FROM rates ORDER BY rate_date").fetchall()
+            dates = self._dates = [date.fromisoformat(row[0]) for row in rows]
+        return dates
+
+    def rate_date_for(self, on_date):
+        """
+        Дата курса, действующего на on_date.
+
+        ЦБ не устанавливает курсы на выходные и праздники, поэтому берется
+        последняя известная дата не позже on_date. None, если курсов нет.
+        """
+        dates = self.dates()
+        i = bisect_right(dates, to_date(on_date))
+        return dates[i - 1] if i else None
+
+    def snapshot_on(self, on_date):
+        """Снимок курсов, действующих на дату, или None"""
+        rate_date = self.rate_date_for(on_date)
+        if rate_date is None:
+            return None
+        return self._snapshot_for(rate_date)
+
+    def _load_snapshot(self, rate_date):
+        with self._lock:
+            rows = self._conn.execute("SELECT code, value, nominal FROM rates WHERE rate_date = ?",
+                                      (rate_date.isoformat(),)).fetchall()
+        rates = {code: {"Value": value, "Nominal": nominal} for code, value, nominal in rows}
+        return RateSnapshot(rates, datetime.combine(rate_date, datetime.min.time()))
+
+    def backfill(self, start, end, session=None):
+        """
+        Загружает из архива ЦБ курсы за период [start, end].
+
+        Даты, которые уже есть в хранилище, пропускаются. Выходные и
+        праздники (404 в архиве) пропускаются без ошибки.
+
+        :return: Количество добавленных записей
+        """
+        start, end = to_date(start), to_date(end)
+        known = set(self.dates())
+        http = session or requests
+        inserted = 0
+        day = start
+        while day <= end:
+            if day not in known:
+                try:
+                    response = http.get(ARCHIVE_URL.format(date=day), timeout=10)
+                    if response.status_code != 404:
+                        response.raise_for_status()
+                        inserted += self.import_daily_json(response.json())
+                except requests.exceptions.RequestException as e:
+                    print(f"Ошибка загрузки курсов на {day}: {e}")
+            day += timedelta(days=1)
+        return inserted
+
+
+_history = None
+_history_lock = threading.Lock()
+
+
+def get_history():
+    """Хранилище исторических курсов по умолчанию (HISTORY_FILE)"""
+    global _history
+    if _history is None:
+        with _history_lock:
+            if _history is None:
+                _history = RateHistory()
+    return _history
+
+
+def get_snapshot_on(on_date):
+    """Снимок курсов ЦБ, действующих на дату, из локального хранилища"""
+    return get_history().snapshot_on(on_date)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Локальное хранилище исторических курсов ЦБ")
+    parser.add_argument("--db", default=HISTORY_FILE, help="Файл хранилища")
+    commands = parser.add_subparsers(dest="command", required=True)
+    backfill = commands.add_parser("backfill", help="Загрузить курсы из архива ЦБ за период")
+    backfill.add_argument("start", help="Начало периода, YYYY-MM-DD")
+    backfill.add_argument("end", help="Конец периода, YYYY-MM-DD")
+    import_cmd = commands.add_parser("import", help="Импортировать сохраненные ответы ЦБ (daily_json.js)")
+    import_cmd.add_argument("files", nargs="+")
+    args = parser.parse_args()
+
+    history = RateHistory(args.db)
+    if args.command == "backfill":
+        with requests.Session() as session:
+            inserted = history.backfill(args.start, args.end, session)
+    else:
+        inserted = 0
+        for path in args.files:
+            with open(path, "r", encoding="utf-8") as f:
+                inserted += history.import_daily_json(json.load(f))
+    print(f"Добавлено записей: {inserted}")
+    history.close()
+
+
+if __name__ == "__main__":
+    main()
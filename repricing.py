@@ -0,0 +1,120 @@
+from collections import Counter
+
+from config import FEE_KEYS
+from currency_converter import get_rate_snapshot
+from tariffs import compute_fees, duty_terms, get_schedule
+
+# Результат reprice: курсы, от которых зависит расчет, не изменились /
+# пересчет несколькими умножениями / полный пересчет (цена перешла границу скобки)
+UNCHANGED = "unchanged"
+FAST = "fast"
+FULL = "full"
+
+
+class DecomposedQuote:
+    """
+    Сохраненный расчет растаможки в разложенном виде.
+
+    Кроме входных данных хранит, как каждый сбор зависит от курсов:
+
+    - оформление, утильсбор и акциз - фиксированные суммы в рублях, пока
+      цена в рублях остается в интервале price_bounds;
+    - пошлина = max(цена в рублях * duty_price_rate, duty_eur_amount * курс евро),
+      для физлиц младше 3 лет - пока цена в евро в интервале eur_price_bounds;
+    - НДС = (цена + пошлина + акциз) * vat_rate.
+
+    price_factor и eur_rate - курсы валюты цены и евро (рублей за единицу), по
+    которым сделан расчет; uses_eur - зависит ли расчет от курса евро.
+    """
+    __slots__ = ('amount', 'currency', 'engine_volume', 'car_age', 'engine_power', 'is_electric', 'is_legal_entity',
+                 'is_commercial', 'fuel_type', 'schedule', 'price_factor', 'eur_rate', 'uses_eur', 'price_bounds',
+                 'eur_price_bounds', 'clearance_fee', 'recycling_fee', 'excise_tax', 'duty_price_rate',
+                 'duty_eur_amount', 'vat_rate', 'fees')
+
+    def __init__(self, amount, currency, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                 is_commercial=False, fuel_type=1, snapshot=None, schedule=None):
+        self.amount = amount
+        self.currency = currency
+        self.engine_volume = engine_volume
+        self.car_age = car_age
+        self.engine_power = engine_power
+        self.is_electric = is_electric
+        self.is_legal_entity = is_legal_entity
+        self.is_commercial = is_commercial
+        self.fuel_type = fuel_type
+        self.schedule = schedule or get_schedule()
+        self._decompose(snapshot or get_rate_snapshot())
+
+    def __repr__(self):
+        return f"DecomposedQuote({self.amount!r} {self.currency}, total={self.total!r})"
+
+    @property
+    def total(self):
+        return self.fees[-1]
+
+    def as_dict(self):
+        """Результат в формате calculate_customs_clearance"""
+        return dict(zip(FEE_KEYS, self.fees))
+
+    def _decompose(self, snapshot):
+        """Полный расчет по тарифам и запоминание зависимостей от курсов"""
+        schedule = self.schedule
+        price = snapshot.convert(self.amount, self.currency, 'RUB')
+        eur_rate = snapshot.to_rub('EUR')
+        self.fees = compute_fees(schedule, price, self.engine_volume, self.car_age, self.engine_power,
+                                 self.is_electric, self.is_legal_entity, self.is_commercial, self.fuel_type,
+                                 eur_rate, lambda amount: snapshot.convert(amount, 'RUB', 'EUR'))
+        self.clearance_fee, _, self.recycling_fee, self.excise_tax, _, _ = self.fees
+        self.price_bounds = schedule.clearance_fee.interval(schedule.clearance_fee.index(price))
+        self.vat_rate = schedule.vat_rate if self.is_legal_entity or self.is_electric else 0
+        self.duty_price_rate, self.duty_eur_amount, self.eur_price_bounds = duty_terms(
+            schedule, snapshot.convert(price, 'RUB', 'EUR'), self.engine_volume, self.car_age, self.is_electric,
+            self.is_legal_entity, self.fuel_type)
+        self.uses_eur = bool(self.duty_eur_amount) or self.eur_price_bounds is not None
+        self.price_factor = snapshot.to_rub(self.currency)
+        self.eur_rate = eur_rate
+
+    def reprice(self, snapshot):
+        """
+        Пересчитывает расчет по новым курсам.
+
+        :return: UNCHANGED, FAST или FULL - каким способом получен результат
+        """
+        factors = snapshot.factors
+        price_factor = factors[self.currency]
+        eur_rate = factors['EUR']
+        if price_factor == self.price_factor and (eur_rate == self.eur_rate or not self.uses_eur):
+            return UNCHANGED
+        # Те же операции, что в RateSnapshot.convert, чтобы результат совпадал с полным расчетом
+        price = self.amount if self.currency == 'RUB' else self.amount * price_factor
+        lo, hi = self.price_bounds
+        if not lo < price <= hi:
+            self._decompose(snapshot)
+            return FULL
+        if self.eur_price_bounds is not None:
+            lo, hi = self.eur_price_bounds
+            if not lo < price / eur_rate <= hi:
+                self._decompose(snapshot)
+                return FULL
+
+        duty = price * self.duty_price_rate
+        eur_duty = self.duty_eur_amount * eur_rate
+        if eur_duty > duty:
+            duty = eur_duty
+        excise_tax = self.excise_tax
+        vat = (price + duty + excise_tax) * self.vat_rate if self.vat_rate else 0
+        self.fees = (self.clearance_fee, duty, self.recycling_fee, excise_tax, vat,
+                     self.clearance_fee + duty + self.recycling_fee + excise_tax + vat)
+        self.price_factor = price_factor
+        self.eur_rate = eur_rate
+        return FAST
+
+
+def reprice_all(quotes, snapshot=None):
+    """
+    Пересчитывает сохраненные расчеты по новым курсам (по умолчанию текущим).
+
+    :return: Counter с количеством расчетов по способам пересчета (UNCHANGED, FAST, FULL)
+    """
+    snapshot = snapshot or get_rate_snapshot()
+    return Counter(map(lambda quote: quote.reprice(snapshot), quotes))
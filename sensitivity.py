@@ -0,0 +1,299 @@
+import math
+from bisect import bisect_left
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from batch_calc import calculate_customs_clearance_batch
+from config import FEE_KEYS
+from currency_converter import get_rate_snapshot
+from tariffs import LEGAL_FUEL_TABLES, compute_fees, duty_terms, get_schedule
+
+# Переменные, по которым строится зависимость итоговой стоимости
+PRICE = "price"
+ENGINE_VOLUME = "engine_volume"
+CAR_AGE = "car_age"
+EUR_RATE = "eur_rate"
+VARIABLES = (PRICE, ENGINE_VOLUME, CAR_AGE, EUR_RATE)
+
+# Относительная точность сравнения значений и наклонов соседних участков
+TOLERANCE = 1e-7
+
+
+@dataclass(slots=True, frozen=True)
+class Segment:
+    """Участок (start, end], на котором итог = intercept + slope * x"""
+    start: float
+    end: float
+    slope: float
+    intercept: float
+
+    def value(self, x):
+        return self.intercept + self.slope * x
+
+
+@dataclass(slots=True, frozen=True)
+class Breakpoint:
+    """
+    Точка излома или скачка итоговой стоимости.
+
+    before - итог в точке x (конец левого участка), after - предел справа.
+    reason - что меняется: clearance_fee (скобка сбора за оформление),
+    duty_bracket (скобка пошлины), duty_minimum (пошлина переходит на
+    минимум в евро за см³ или обратно), recycling (скобка утильсбора),
+    age_band (возрастная группа).
+    """
+    x: float
+    before: float
+    after: float
+    reason: str
+
+    @property
+    def jump(self):
+        return self.after - self.before
+
+
+@dataclass(slots=True)
+class Sweep:
+    """Итоговая стоимость (цена + растаможка, в рублях) как кусочно-линейная функция переменной"""
+    variable: str
+    segments: list
+    breakpoints: list
+    evaluate: object = field(default=None, repr=False)  # точный расчет итога в точке x
+
+    def value(self, x):
+        """Итог в точке x внутри диапазона"""
+        i = bisect_left([segment.end for segment in self.segments], x)
+        return self.segments[min(i, len(self.segments) - 1)].value(x)
+
+    def points(self):
+        """Точки (x, итог) для графика: концы участков, в точках скачка - оба значения"""
+        points = []
+        for segment in self.segments:
+            points.append((segment.start, segment.value(segment.start)))
+            points.append((segment.end, segment.value(segment.end)))
+        return points
+
+
+class _Model:
+    """Итоговая стоимость как функция одной переменной при остальных фиксированных параметрах"""
+
+    def __init__(self, variable, price, currency, engine_volume, car_age, engine_power, is_electric,
+                 is_legal_entity, is_commercial, fuel_type, snapshot, schedule):
+        if variable not in VARIABLES:
+            raise ValueError(f"Неизвестная переменная: {variable}. Допустимые: {', '.join(VARIABLES)}")
+        self.variable = variable
+        self.price = price
+        self.currency = currency
+        self.engine_volume = engine_volume
+        self.car_age = car_age
+        self.engine_power = engine_power
+        self.is_electric = is_electric
+        self.is_legal_entity = is_legal_entity
+        self.is_commercial = is_commercial
+        self.fuel_type = fuel_type
+        self.schedule = schedule
+        self.price_factor = snapshot.to_rub(currency)
+        self.eur_rate = snapshot.to_rub('EUR')
+
+    def inputs(self, x):
+        """(цена в рублях, объем, возраст, курс евро) при значении переменной x"""
+        price, volume, age, eur_rate = self.price, self.engine_volume, self.car_age, self.eur_rate
+        variable = self.variable
+        if variable == PRICE:
+            price = x
+        elif variable == ENGINE_VOLUME:
+            volume = x
+        elif variable == CAR_AGE:
+            age = x
+        else:
+            eur_rate = x
+        if self.currency == 'EUR':
+            price_rub = price * eur_rate
+        elif self.currency == 'RUB':
+            price_rub = price
+        else:
+            price_rub = price * self.price_factor
+        return price_rub, volume, age, eur_rate
+
+    def total(self, x):
+        price, volume, age, eur_rate = self.inputs(x)
+        fees = compute_fees(self.schedule, price, volume, age, self.engine_power, self.is_electric,
+                            self.is_legal_entity, self.is_commercial, self.fuel_type, eur_rate,
+                            lambda amount: amount / eur_rate)
+        return price + fees[-1]
+
+    def _rub_per_unit(self, eur_rate):
+        """Рублей за единицу цены при курсе евро eur_rate"""
+        if self.currency == 'EUR':
+            return eur_rate
+        return 1.0 if self.currency == 'RUB' else self.price_factor
+
+    def boundaries(self):
+        """Значения переменной, где меняется скобка какого-либо тарифа: [(x, reason)]"""
+        schedule = self.schedule
+        age, eur_rate = self.car_age, self.eur_rate
+        individual_new = not self.is_electric and not self.is_legal_entity and age < 3
+        result = []
+        if self.variable == PRICE:
+            rub = self._rub_per_unit(eur_rate)
+            result += [(bound / rub, "clearance_fee") for bound in schedule.clearance_fee.bounds]
+            if individual_new:
+                result += [(bound * eur_rate / rub, "duty_bracket")
+                           for bound in schedule.individual_duty["new"].bounds]
+        elif self.variable == ENGINE_VOLUME and not self.is_electric:
+            if self.is_legal_entity:
+                tables = schedule.legal_duty[LEGAL_FUEL_TABLES[self.fuel_type]]
+                table = tables["new" if age < 3 else "3_7" if age <= 7 else "old"]
+            else:
+                table = None if age < 3 else schedule.individual_duty["3_5" if age <= 5 else "old"]
+            if table is not None:
+                result += [(bound, "duty_bracket") for bound in table.bounds]
+            use = "commercial" if self.is_commercial or self.is_legal_entity else "personal"
+            result += [(bound, "recycling")
+                       for bound in schedule.recycling[use]["new" if age < 3 else "old"].bounds]
+        elif self.variable == EUR_RATE:
+            if self.currency == 'EUR':
+                # Цена в рублях растет вместе с курсом, цена в евро постоянна
+                result += [(bound / self.price, "clearance_fee") for bound in schedule.clearance_fee.bounds
+                           if self.price > 0]
+            elif individual_new:
+                price = self.price * self._rub_per_unit(eur_rate)
+                result += [(price / bound, "duty_bracket") for bound in schedule.individual_duty["new"].bounds]
+        return result
+
+    def kink(self, lo, hi):
+        """
+        Точка внутри (lo, hi), где пошлина переключается между процентом от
+        цены и минимумом в евро (скобки тарифов на интервале не меняются), или None.
+        """
+        x = lo + (hi - lo) / 2
+        price, volume, age, eur_rate = self.inputs(x)
+        rate, eur_amount, _ = duty_terms(self.schedule, price / eur_rate, volume, age, self.is_electric,
+                                         self.is_legal_entity, self.fuel_type)
+        if not rate or not eur_amount:
+            return None
+        if self.variable == PRICE:
+            # price * rub * rate = eur_amount * eur_rate
+            point = eur_amount * eur_rate / (rate * self._rub_per_unit(eur_rate))
+        elif self.variable == ENGINE_VOLUME:
+            # price * rate = (eur_amount / volume) * x * eur_rate
+            point = price * rate * volume / (eur_amount * eur_rate)
+        elif self.variable == EUR_RATE and self.currency != 'EUR':
+            point = price * rate / eur_amount
+        else:
+            return None
+        return point if lo < point < hi else None
+
+
+def _linear_segment(model, start, end):
+    """Прямая через две внутренние точки участка (на участке итог линеен)"""
+    x1 = start + (end - start) / 3
+    x2 = start + 2 * (end - start) / 3
+    y1, y2 = model.total(x1), model.total(x2)
+    slope = (y2 - y1) / (x2 - x1)
+    return Segment(start, end, slope, y1 - slope * x1)
+
+
+def _close(a, b):
+    return abs(a - b) <= TOLERANCE * max(1.0, abs(a), abs(b))
+
+
+def _merge(segments, reasons):
+    """Склеивает соседние участки без скачка и излома и собирает точки разрыва"""
+    merged = [segments[0]]
+    breakpoints = []
+    for segment, reason in zip(segments[1:], reasons):
+        left = merged[-1]
+        x = left.end
+        before, after = left.value(x), segment.value(x)
+        if _close(before, after) and _close(left.slope, segment.slope):
+            merged[-1] = Segment(left.start, segment.end, left.slope, left.intercept)
+            continue
+        breakpoints.append(Breakpoint(x, before, after, reason))
+        merged.append(segment)
+    return merged, breakpoints
+
+
+def _age_sweep(model, lo, hi):
+    """Возраст - целое число лет: итог постоянен внутри возрастной группы"""
+    ages = range(math.ceil(lo), math.floor(hi) + 1)
+    if not ages:
+        raise ValueError(f"В диапазоне [{lo}, {hi}] нет целых значений возраста")
+    segments = [Segment(age - 1 if i else lo, age, 0.0, model.total(age)) for i, age in enumerate(ages)]
+    return _merge(segments, ["age_band"] * (len(segments) - 1))
+
+
+def sweep_total(variable, lo, hi, price, currency='RUB', engine_volume=2000, car_age=4, engine_power=170,
+                is_electric=False, is_legal_entity=False, is_commercial=False, fuel_type=1, snapshot=None,
+                schedule=None):
+    """
+    Зависимость итоговой стоимости (цена авто + растаможка, в рублях) от одной переменной.
+
+    Границы участков берутся из скобок тарифов, а точка, где пошлина
+    переходит с процента от цены на минимум в евро, вычисляется по формуле,
+    поэтому для построения нужно лишь несколько расчетов на участок.
+
+    :param variable: PRICE (цена в валюте currency), ENGINE_VOLUME, CAR_AGE или EUR_RATE
+    :param lo: Начало диапазона переменной
+    :param hi: Конец диапазона переменной
+    :param price: Цена авто в валюте currency (остальные параметры - как в calculate_customs_clearance)
+    :param snapshot: Снимок курсов (по умолчанию текущий)
+    :param schedule: Набор тарифов (по умолчанию действующий)
+    :return: Sweep с участками и точками разрыва
+    """
+    if not lo < hi:
+        raise ValueError("Начало диапазона должно быть меньше конца")
+    snapshot = snapshot or get_rate_snapshot()
+    schedule = schedule or get_schedule()
+    model = _Model(variable, price, currency, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                   is_commercial, fuel_type, snapshot, schedule)
+    if variable == CAR_AGE:
+        segments, breakpoints = _age_sweep(model, lo, hi)
+        return Sweep(variable, segments, breakpoints, model.total)
+
+    bounds = sorted({(x, reason) for x, reason in model.boundaries() if lo < x < hi})
+    cuts = [lo]
+    reasons = []
+    for x, reason in bounds:
+        if x == cuts[-1]:
+            continue
+        cuts.append(x)
+        reasons.append(reason)
+    cuts.append(hi)
+
+    edges = [cuts[0]]
+    edge_reasons = []
+    for i, (start, end) in enumerate(zip(cuts, cuts[1:])):
+        kink = model.kink(start, end)
+        if kink is not None:
+            edges.append(kink)
+            edge_reasons.append("duty_minimum")
+        edges.append(end)
+        if i < len(reasons):
+            edge_reasons.append(reasons[i])
+
+    segments = [_linear_segment(model, start, end) for start, end in zip(edges, edges[1:])]
+    segments, breakpoints = _merge(segments, edge_reasons)
+    return Sweep(variable, segments, breakpoints, model.total)
+
+
+def evaluate_grid(variable, xs, price, currency='RUB', engine_volume=2000, car_age=4, engine_power=170,
+                  is_electric=False, is_legal_entity=False, is_commercial=False, fuel_type=1, snapshot=None,
+                  schedule=None):
+    """
+    Итоговая стоимость в точках xs векторным расчетом (calculate_customs_clearance_batch).
+
+    Запасной вариант для произвольной сетки; параметры как у sweep_total.
+
+    :return: np.ndarray итоговой стоимости в рублях
+    """
+    snapshot = snapshot or get_rate_snapshot()
+    schedule = schedule or get_schedule()
+    model = _Model(variable, price, currency, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                   is_commercial, fuel_type, snapshot, schedule)
+    price_rub, volume, age, eur_rate = model.inputs(np.asarray(xs, dtype=float))
+    fees = calculate_customs_clearance_batch(price_rub, volume, age, engine_power, is_electric, is_legal_entity,
+                                             is_commercial, fuel_type, exchange_rate=eur_rate, schedule=schedule,
+                                             price_eur=price_rub / eur_rate)
+    return price_rub + fees[FEE_KEYS[-1]]
@@ -0,0 +1,130 @@
+import mmap
+import os
+import struct
+import time
+from array import array
+from datetime import datetime, timedelta
+
+from currency_converter import RateSnapshot
+
+try:
+    import fcntl
+except ImportError:  # Windows: блокировка файла недоступна
+    fcntl = None
+
+# Формат файла (числа в порядке байт машины - файл общий только для процессов одной машины):
+#   заголовок: магическая строка, поколение, время курсов (мкс от 1970-01-01),
+#              mtime файла кэша (нс, -1 - нет), количество валют
+#   коды валют: MAX_CURRENCIES записей по CODE_SIZE байт (ASCII, дополнены нулями)
+#   курсы: MAX_CURRENCIES чисел double - рублей за единицу валюты, в порядке кодов
+MAGIC = b"CCRATES1"
+MAX_CURRENCIES = 96
+CODE_SIZE = 8
+_HEADER = struct.Struct("=8sQqqI")
+_GENERATION = struct.Struct("=Q")
+_GENERATION_OFFSET = 8
+_CODES_OFFSET = 64
+_FACTORS_OFFSET = _CODES_OFFSET + MAX_CURRENCIES * CODE_SIZE
+FILE_SIZE = _FACTORS_OFFSET + MAX_CURRENCIES * 8
+
+# Сколько раз читатель повторяет чтение, если попал на запись
+READ_RETRIES = 100
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _open_mapping(path):
+    """Открывает (и при необходимости создает нулевым) файл снимка и отображает его в память"""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if os.fstat(fd).st_size < FILE_SIZE:
+            os.ftruncate(fd, FILE_SIZE)
+        return mmap.mmap(fd, FILE_SIZE)
+    finally:
+        os.close(fd)
+
+
+class SharedRates:
+    """
+    Снимок курсов ЦБ, общий для всех процессов на машине (файл в памяти, mmap).
+
+    Один процесс публикует снимок (publish), остальные читают его без
+    разбора JSON: если поколение в заголовке не изменилось, snapshot()
+    возвращает уже построенный RateSnapshot после чтения одного числа.
+
+    Запись защищена счетчиком поколений (seqlock): на время записи поколение
+    нечетное, после записи - следующее четное. Читатель копирует данные и
+    повторяет чтение, если поколение было нечетным или изменилось.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._map = _open_mapping(path)
+        self._factors = memoryview(self._map)[_FACTORS_OFFSET:FILE_SIZE].cast("d")
+        self._generation = None
+        self._snapshot = None
+
+    def close(self):
+        self._factors.release()
+        self._map.close()
+
+    def generation(self):
+        return _GENERATION.unpack_from(self._map, _GENERATION_OFFSET)[0]
+
+    def snapshot(self):
+        """Опубликованный снимок или None, если в файле еще ничего нет"""
+        generation = self.generation()
+        if generation == self._generation:
+            return self._snapshot
+        for _ in range(READ_RETRIES):
+            if generation & 1:
+                time.sleep(0)
+                generation = self.generation()
+                continue
+            magic, _, timestamp_us, source_mtime, count = _HEADER.unpack_from(self._map, 0)
+            count = min(count, MAX_CURRENCIES)
+            codes = self._map[_CODES_OFFSET:_CODES_OFFSET + count * CODE_SIZE]
+            factors = self._factors[:count].tolist()
+            current = self.generation()
+            if current == generation:
+                break
+            generation = current
+        else:
+            # Запись не успела завершиться: отдаем последний прочитанный снимок
+            return self._snapshot
+        snapshot = None
+        if magic == MAGIC:
+            codes = [codes[i:i + CODE_SIZE].rstrip(b"\0").decode("ascii") for i in range(0, len(codes), CODE_SIZE)]
+            snapshot = RateSnapshot.from_factors(dict(zip(codes, factors)), _EPOCH + timestamp_us * _MICROSECOND,
+                                                 None if source_mtime < 0 else source_mtime)
+        self._generation, self._snapshot = generation, snapshot
+        return snapshot
+
+    def publish(self, snapshot):
+        """
+        Публикует снимок, если он новее опубликованного.
+
+        :return: True, если снимок записан
+        """
+        codes = [code for code in snapshot.codes if code != "RUB"]
+        if len(codes) > MAX_CURRENCIES:
+            raise ValueError(f"Слишком много валют: {len(codes)} (не больше {MAX_CURRENCIES})")
+        timestamp_us = (snapshot.timestamp - _EPOCH) // _MICROSECOND
+        source_mtime = -1 if snapshot.source_mtime is None else snapshot.source_mtime
+        with open(self.path + ".lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            generation = self.generation()
+            magic, _, published_us, _, _ = _HEADER.unpack_from(self._map, 0)
+            if magic == MAGIC and published_us >= timestamp_us:
+                return False
+            # Упавший посреди записи процесс мог оставить нечетное поколение
+            generation += 1 if generation & 1 else 2
+            _GENERATION.pack_into(self._map, _GENERATION_OFFSET, generation - 1)
+            encoded = b"".join(code.encode("ascii").ljust(CODE_SIZE, b"\0") for code in codes)
+            self._map[_CODES_OFFSET:_CODES_OFFSET + len(encoded)] = encoded
+            self._factors[:len(codes)] = array("d", (snapshot.factors[code] for code in codes))
+            _HEADER.pack_into(self._map, 0, MAGIC, generation - 1, timestamp_us, source_mtime, len(codes))
+            _GENERATION.pack_into(self._map, _GENERATION_OFFSET, generation)
+        return True
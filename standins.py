@@ -0,0 +1,120 @@
+# Локальные заменители внешних сервисов для бенчмарков и нагрузочных тестов.
+# Сервера отдают записанные ответы из fixtures/ и могут добавлять задержку,
+# чтобы имитировать медленный каталог Encar, сайт ЦБ или хост фотографий.
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixture(name):
+    with open(os.path.join(FIXTURES_DIR, name), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class StandinServer:
+    """
+    HTTP-сервер в фоновом потоке.
+
+    Используется как контекстный менеджер; адрес доступен в url.
+    handle(path, query) возвращает (статус, заголовки, тело в байтах).
+    """
+
+    def __init__(self, handle, latency=0.0, host="127.0.0.1", port=0):
+        self.handle = handle
+        self.latency = latency
+        self.requests = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                parsed = urlparse(self.path)
+                status, headers, body = server.handle(parsed.path, parse_qs(parsed.query))
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def _json_response(data, status=200):
+    return status, {"Content-Type": "application/json; charset=utf-8"}, json.dumps(data, ensure_ascii=False).encode()
+
+
+def catalog_server(listings=None, latency=0.0):
+    """Заменитель каталога Encar: /catalog?car=<id> отдает карточку из listings или {"code": 404}"""
+    listings = load_fixture("encar_catalog.json") if listings is None else listings
+
+    def handle(path, query):
+        car_id = query.get("car", [""])[0]
+        if path.rstrip("/").endswith("catalog") and car_id in listings:
+            return _json_response(listings[car_id])
+        return _json_response({"code": 404}, 404)
+
+    return StandinServer(handle, latency)
+
+
+def cbr_server(daily=None, latency=0.0):
+    """Заменитель cbr-xml-daily.ru: отдает один и тот же daily_json.js на любой путь"""
+    daily = load_fixture("cbr_daily.json") if daily is None else daily
+
+    def handle(path, query):
+        return _json_response(daily)
+
+    return StandinServer(handle, latency)
+
+
+def photo_server(width=1160, height=696, latency=0.0):
+    """Заменитель ci.encar.com: на любой путь отдает одно и то же JPEG-фото width x height"""
+    import io
+
+    from PIL import Image
+
+    image = Image.new("RGB", (width, height))
+    image.putdata([(x * 255 // width, y * 255 // height, 128) for y in range(height) for x in range(width)])
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=90)
+    body = buffer.getvalue()
+
+    def handle(path, query):
+        return 200, {"Content-Type": "image/jpeg"}, body
+
+    return StandinServer(handle, latency)
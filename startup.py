@@ -0,0 +1,213 @@
+"""
+Быстрый холодный старт калькулятора.
+
+    python startup.py bundle             # при сборке: снимок курсов рядом с кодом (rates_snapshot.json)
+    python startup.py serve [--port N]   # прогрев, затем Streamlit (app.py) в том же процессе
+    python startup.py warm               # только прогрев, печатает время этапов
+    python startup.py measure            # время холодного старта в чистых процессах (проверка регрессий)
+
+serve сначала импортирует тяжелые модули, поднимает снимок курсов (из кэша
+или собранного снимка, не дожидаясь ЦБ), открывает хранилище карточек и
+делает пробный расчет, и только потом открывает порт: первая сессия не
+ждет ни импортов, ни загрузки курсов.
+"""
+import argparse
+import importlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import metrics
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+# Модули, которые app.py импортирует при первом запуске скрипта
+WARM_MODULES = ("numpy", "streamlit", "config", "batch_calc", "encar", "listing_store", "quote_cache", "sensitivity")
+# Сколько раз measure запускает холодный старт (берется медиана)
+MEASURE_RUNS = 5
+# Допустимый рост времени холодного старта относительно базовых результатов
+REGRESSION_THRESHOLD = 0.25
+
+
+def build_bundle(output=None):
+    """
+    Записывает снимок курсов для первого запуска (currency_converter.BUNDLED_RATES_FILE).
+
+    Берется свежий кэш курсов, а если его нет - курсы загружаются с сайта ЦБ.
+
+    :return: Записанная структура {"timestamp", "data"}
+    """
+    import currency_converter
+
+    output = output or currency_converter.BUNDLED_RATES_FILE
+    cache = currency_converter._read_cache()
+    if cache is None or not currency_converter._is_cache_fresh(cache):
+        cache = currency_converter._refresh_rates()
+    if cache is None:
+        raise RuntimeError("Не удалось получить курсы валют для снимка")
+    fd, tmp_path = tempfile.mkstemp(prefix=".rates_snapshot.", suffix=".tmp",
+                                    dir=os.path.dirname(os.path.abspath(output)))
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, output)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    return cache
+
+
+def warm_up(modules=WARM_MODULES):
+    """
+    Прогревает процесс перед приемом запросов.
+
+    :return: Словарь {этап: секунды}, последним идет "total"
+    """
+    timings = {}
+    start = time.perf_counter()
+
+    def stage(name, func):
+        stage_start = time.perf_counter()
+        with metrics.timed(f"startup_{name}"):
+            result = func()
+        timings[name] = time.perf_counter() - stage_start
+        return result
+
+    stage("imports", lambda: [importlib.import_module(module) for module in modules])
+
+    from currency_converter import get_rate_snapshot, start_rate_refresher
+    # Кэш или собранный снимок; свежие курсы догружаются в фоне
+    snapshot = stage("rates", get_rate_snapshot)
+    start_rate_refresher()
+
+    from tariffs import start_schedule_watcher
+    start_schedule_watcher()
+
+    from listing_store import get_store
+    stage("listing_store", get_store)
+
+    if snapshot is not None:
+        from batch_calc import calculate_customs_clearance_batch
+        from config import calculate_customs_clearance
+        eur_rate = snapshot.to_rub("EUR")
+
+        def calc():
+            calculate_customs_clearance(2_500_000, 1998, 4, 190, False, False, exchange_rate=eur_rate)
+            calculate_customs_clearance_batch([2_500_000], 1998, 4, 190, False, False, exchange_rate=eur_rate)
+
+        stage("calc", calc)
+
+    timings["total"] = time.perf_counter() - start
+    metrics.observe("startup", timings["total"])
+    return timings
+
+
+def print_timings(timings):
+    for name, seconds in timings.items():
+        print(f"{name:<16}{seconds * 1000:>10.1f} мс")
+
+
+def serve(port=None, headless=True):
+    """Прогревает процесс и запускает Streamlit с app.py в нем же (импорты и курсы уже в памяти)"""
+    timings = warm_up()
+    print("Прогрев перед запуском:")
+    print_timings(timings)
+
+    from streamlit.web import bootstrap
+
+    flag_options = {"server_headless": headless}
+    if port is not None:
+        flag_options["server_port"] = port
+    bootstrap.load_config_options(flag_options)
+    bootstrap.run(APP_SCRIPT, False, [], flag_options)
+
+
+def _cold_start(env, cwd):
+    """Один холодный старт в новом процессе: (секунды до готовности, этапы прогрева)"""
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "warm", "--json"], env=env, cwd=cwd,
+                            capture_output=True, text=True, check=True).stdout
+    wall = time.perf_counter() - start
+    return wall, json.loads(output.splitlines()[-1])
+
+
+def measure(runs=MEASURE_RUNS):
+    """
+    Время холодного старта: запуск интерпретатора и warm_up в чистом каталоге
+    без кэша курсов, с собранным снимком и недоступным ЦБ.
+
+    :return: Словарь {этап: медиана секунд}, "process" - полное время процесса
+    """
+    from standins import load_fixture
+
+    workdir = tempfile.mkdtemp(prefix="customscalc-startup-")
+    bundle = os.path.join(workdir, "rates_snapshot.json")
+    with open(bundle, "w", encoding="utf-8") as f:
+        json.dump({"timestamp": datetime.now().isoformat(), "data": load_fixture("cbr_daily.json")["Valute"]}, f)
+    env = dict(os.environ, BUNDLED_RATES_FILE=bundle, CUSTOMSCALC_METRICS="0",
+               CBR_URL="http://127.0.0.1:9/", PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+
+    samples = {}
+    for i in range(runs):
+        run_dir = os.path.join(workdir, f"run{i}")
+        os.mkdir(run_dir)
+        wall, timings = _cold_start(env, run_dir)
+        for name, seconds in {**timings, "process": wall}.items():
+            samples.setdefault(name, []).append(seconds)
+    return {name: sorted(values)[len(values) // 2] for name, values in samples.items()}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Быстрый холодный старт калькулятора")
+    commands = parser.add_subparsers(dest="command", required=True)
+    bundle_parser = commands.add_parser("bundle", help="Собрать снимок курсов для первого запуска")
+    bundle_parser.add_argument("--output", help="Файл снимка (по умолчанию BUNDLED_RATES_FILE)")
+    serve_parser = commands.add_parser("serve", help="Прогреть процесс и запустить Streamlit")
+    serve_parser.add_argument("--port", type=int)
+    warm_parser = commands.add_parser("warm", help="Только прогрев с отчетом о времени этапов")
+    warm_parser.add_argument("--json", action="store_true", help="Вывести время этапов в JSON")
+    measure_parser = commands.add_parser("measure", help="Измерить холодный старт")
+    measure_parser.add_argument("--runs", type=int, default=MEASURE_RUNS)
+    measure_parser.add_argument("--save", help="Сохранить результаты в JSON (базовые результаты)")
+    measure_parser.add_argument("--compare", help="Сравнить с базовыми результатами из JSON")
+    measure_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                                help="Допустимый рост времени, доля (по умолчанию 0.25)")
+    args = parser.parse_args(argv)
+
+    if args.command == "bundle":
+        cache = build_bundle(args.output)
+        print(f"Снимок курсов от {cache['timestamp']}: {len(cache['data'])} валют")
+    elif args.command == "serve":
+        serve(args.port)
+    elif args.command == "warm":
+        timings = warm_up()
+        if args.json:
+            print(json.dumps(timings))
+        else:
+            print_timings(timings)
+    else:
+        results = measure(args.runs)
+        print_timings(results)
+        status = 0
+        if args.compare:
+            with open(args.compare, "r", encoding="utf-8") as f:
+                baseline = json.load(f)["results"]
+            change = results["process"] / baseline["process"] - 1
+            if change > args.threshold:
+                print(f"РЕГРЕССИЯ холодного старта: {change:+.1%}", file=sys.stderr)
+                status = 1
+            else:
+                print(f"Холодный старт {change:+.1%} к базовому (порог {args.threshold:.0%})")
+        if args.save:
+            with open(args.save, "w", encoding="utf-8") as f:
+                json.dump({"created": datetime.now().isoformat(timespec="seconds"), "results": results}, f,
+                          ensure_ascii=False, indent=2)
+        return status
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
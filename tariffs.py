@@ -0,0 +1,538 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+
+import metrics
+
+# Каталог версий тарифов. Каждый файл *.json описывает изменения по одному постановлению:
+#   {"effective_from": "YYYY-MM-DD", "tariffs": {раздел TARIFF_DATA: новое значение, ...}}
+# Версия действует с effective_from до начала следующей. Разделы, которых нет в файле,
+# переходят из предыдущей версии; самая ранняя версия - встроенные TARIFF_DATA.
+TARIFF_SCHEDULES_DIR = os.environ.get("TARIFF_SCHEDULES_DIR",
+                                      os.path.join(os.path.dirname(os.path.abspath(__file__)), "tariff_schedules"))
+# Как часто фоновый поток проверяет каталог версий (в секундах)
+SCHEDULE_CHECK_INTERVAL = 30
+BUILTIN_VERSION = "builtin"
+
+# Тарифы растаможки в декларативном виде.
+# Скобка записывается как [граница, значение]: значение применяется, если
+# величина <= граница. Последняя скобка имеет границу None (без ограничения).
+TARIFF_DATA = {
+    # Сбор за таможенное оформление по стоимости авто в рублях
+    "clearance_fee": [
+        [200_000, 1067],
+        [450_000, 2134],
+        [1_200_000, 4269],
+        [2_700_000, 11746],
+        [4_200_000, 16524],
+        [5_500_000, 21344],
+        [7_000_000, 27540],
+        [None, 30000],
+    ],
+    # Для электромобилей фиксированная ставка от стоимости
+    "electric_duty_rate": 0.15,
+    # Пошлина для физических лиц
+    "individual_duty": {
+        # младше 3 лет: по цене в евро, [ставка, минимум евро за см³]
+        "new": [
+            [8500, [0.54, 2.5]],
+            [16700, [0.48, 3.5]],
+            [42300, [0.48, 5.5]],
+            [84500, [0.48, 7.5]],
+            [169000, [0.48, 15]],
+            [None, [0.48, 20]],
+        ],
+        # от 3 до 5 лет: по объему, евро за см³
+        "3_5": [
+            [1000, 1.5],
+            [1500, 1.7],
+            [1800, 2.5],
+            [2300, 2.7],
+            [3000, 3],
+            [None, 3.6],
+        ],
+        # старше 5 лет: по объему, евро за см³
+        "old": [
+            [1000, 3],
+            [1500, 3.2],
+            [1800, 3.5],
+            [2300, 4.8],
+            [3000, 5],
+            [None, 7.5],
+        ],
+    },
+    # Пошлина для юридических лиц по типу двигателя
+    "legal_duty": {
+        # бензиновый двигатель или гибрид
+        "petrol": {
+            # младше 3 лет: по объему, ставка от стоимости
+            "new": [
+                [2800, 0.15],
+                [None, 0.125],
+            ],
+            # от 3 до 7 лет: по объему, [ставка, минимум евро за см³]
+            "3_7": [
+                [1000, [0.2, 0.36]],
+                [1500, [0.2, 0.4]],
+                [1800, [0.2, 0.36]],
+                [3000, [0.2, 0.44]],
+                [None, [0.2, 0.8]],
+            ],
+            # старше 7 лет: по объему, евро за см³
+            "old": [
+                [1000, 1.4],
+                [1500, 1.5],
+                [1800, 1.6],
+                [3000, 2.2],
+                [None, 3.2],
+            ],
+        },
+        # дизельный двигатель
+        "diesel": {
+            "new": [
+                [None, 0.15],
+            ],
+            "3_7": [
+                [1500, [0.2, 0.32]],
+                [2500, [0.2, 0.4]],
+                [None, [0.2, 0.8]],
+            ],
+            "old": [
+                [1500, 1.5],
+                [2500, 2.2],
+                [None, 3.2],
+            ],
+        },
+    },
+    # Базовая ставка утилизационного сбора
+    "recycling_base": {
+        "individual": 20_000,
+        "legal": 150_000,
+    },
+    # Коэффициенты утилизационного сбора по объему двигателя
+    "recycling": {
+        # для перепродажи или юридических лиц
+        "commercial": {
+            "electric_new": 33.37,
+            "electric_old": 58.7,
+            "new": [
+                [1000, 9.01],
+                [2000, 33.37],
+                [3000, 93.77],
+                [3500, 107.67],
+                [None, 137.11],
+            ],
+            "old": [
+                [1000, 23],
+                [2000, 58.7],
+                [3000, 141.97],
+                [3500, 165.84],
+                [None, 180.24],
+            ],
+        },
+        # для личного пользования
+        "personal": {
+            "electric_new": 0.17,
+            "electric_old": 0.26,
+            "new": [
+                [3000, 0.17],
+                [3500, 107.67],
+                [None, 137.11],
+            ],
+            "old": [
+                [3000, 0.26],
+                [3500, 165.84],
+                [None, 180.24],
+            ],
+        },
+    },
+    # Акциз: рублей за л.с. по мощности двигателя
+    "excise": [
+        [90, 0],
+        [150, 61],
+        [200, 583],
+        [300, 955],
+        [400, 1628],
+        [500, 1685],
+        [None, 1740],
+    ],
+    "vat_rate": 0.20,
+}
+
+# Тип топлива юридического лица -> таблица пошлины (1 - Бензин, 2 - Дизель, 3 - Гибрид)
+LEGAL_FUEL_TABLES = {1: "petrol", 2: "diesel", 3: "petrol"}
+
+
+class Brackets:
+    """
+    Скомпилированная таблица скобок.
+
+    Границы хранятся отсортированным кортежем, значение ищется бинарным
+    поиском: lookup(x) возвращает значение первой скобки, где x <= граница.
+    """
+    __slots__ = ('bounds', 'values')
+
+    def __init__(self, rows):
+        if not rows or rows[-1][0] is not None:
+            raise ValueError("Последняя скобка должна иметь границу None")
+        bounds = tuple(bound for bound, _ in rows[:-1])
+        if any(a >= b for a, b in zip(bounds, bounds[1:])):
+            raise ValueError(f"Границы скобок должны строго возрастать: {bounds}")
+        self.bounds = bounds
+        self.values = tuple(tuple(value) if isinstance(value, list) else value for _, value in rows)
+
+    def __repr__(self):
+        return f"Brackets(bounds={self.bounds!r}, values={self.values!r})"
+
+    def index(self, x):
+        """Номер скобки, в которую попадает x"""
+        return bisect_left(self.bounds, x)
+
+    def lookup(self, x):
+        """Значение скобки, в которую попадает x"""
+        return self.values[bisect_left(self.bounds, x)]
+
+    def interval(self, i):
+        """Интервал (lo, hi] значений, попадающих в скобку i"""
+        lo = self.bounds[i - 1] if i else float("-inf")
+        hi = self.bounds[i] if i < len(self.bounds) else float("inf")
+        return lo, hi
+
+
+class TariffSchedule:
+    """
+    Набор тарифов, скомпилированный из декларативного описания (см. TARIFF_DATA).
+
+    version - имя версии (имя файла в TARIFF_SCHEDULES_DIR и хэш содержимого, см.
+    load_schedules, или BUILTIN_VERSION), effective_from - дата начала действия.
+    """
+
+    def __init__(self, data, version=BUILTIN_VERSION, effective_from=date.min):
+        self.data = data
+        self.version = version
+        self.effective_from = effective_from
+        self.clearance_fee = Brackets(data["clearance_fee"])
+        self.electric_duty_rate = data["electric_duty_rate"]
+        self.individual_duty = {band: Brackets(rows) for band, rows in data["individual_duty"].items()}
+        self.legal_duty = {
+            fuel: {band: Brackets(rows) for band, rows in bands.items()}
+            for fuel, bands in data["legal_duty"].items()
+        }
+        self.recycling_base = dict(data["recycling_base"])
+        self.recycling = {}
+        for use, tables in data["recycling"].items():
+            self.recycling[use] = {
+                band: Brackets(value) if isinstance(value, list) else value
+                for band, value in tables.items()
+            }
+        self.excise = Brackets(data["excise"])
+        self.vat_rate = data["vat_rate"]
+
+    def __repr__(self):
+        return f"TariffSchedule(version={self.version!r}, effective_from={self.effective_from.isoformat()!r})"
+
+
+def compile_schedule(data, version=BUILTIN_VERSION, effective_from=date.min):
+    """Компилирует декларативное описание тарифов в TariffSchedule"""
+    return TariffSchedule(data, version, effective_from)
+
+
+# Встроенные тарифы компилируются один раз при импорте. Действующий набор - get_schedule():
+# он учитывает версии из TARIFF_SCHEDULES_DIR
+TARIFFS = compile_schedule(TARIFF_DATA)
+
+
+def _as_date(value):
+    return value if type(value) is date else date.fromisoformat(str(value)[:10])
+
+
+class ScheduleIndex:
+    """
+    Неизменяемый набор версий тарифов, упорядоченных по дате начала действия.
+
+    Версия на дату ищется бинарным поиском. Новые версии не дописываются в
+    существующий индекс: строится новый и заменяет старый одним
+    присваиванием, поэтому читателям не нужны блокировки.
+    """
+    __slots__ = ('dates', 'schedules', 'signature')
+
+    def __init__(self, schedules, signature=()):
+        schedules = sorted(schedules, key=lambda schedule: schedule.effective_from)
+        self.dates = tuple(schedule.effective_from for schedule in schedules)
+        if any(a == b for a, b in zip(self.dates, self.dates[1:])):
+            raise ValueError(f"Несколько версий тарифов с одной датой начала действия: {self.dates}")
+        self.schedules = tuple(schedules)
+        self.signature = signature
+
+    def __len__(self):
+        return len(self.schedules)
+
+    def on(self, on_date):
+        """Версия, действующая на дату on_date"""
+        return self.schedules[max(bisect_right(self.dates, on_date) - 1, 0)]
+
+    def versions(self):
+        """[(версия, дата начала действия)] в порядке дат"""
+        return [(schedule.version, schedule.effective_from) for schedule in self.schedules]
+
+
+def _directory_signature(directory):
+    """Имена, размеры и времена изменения файлов версий: по ним видно, что каталог изменился"""
+    try:
+        entries = [entry for entry in os.scandir(directory) if entry.is_file() and entry.name.endswith(".json")]
+    except OSError:
+        return ()
+    return tuple(sorted((entry.name, entry.stat().st_size, entry.stat().st_mtime_ns) for entry in entries))
+
+
+def load_schedules(directory=TARIFF_SCHEDULES_DIR):
+    """
+    Читает версии тарифов из каталога (отсутствующий каталог - только встроенные тарифы).
+
+    Версия - "имя_файла@хэш": хэш считается по содержимому этого и всех более
+    ранних файлов, из которых складывается набор, поэтому правка файла на месте
+    меняет версию, и кэши расчетов (ключ по версии) не отдают старые суммы.
+
+    :return: ScheduleIndex
+    :raises ValueError: Файл версии некорректен; ни одна версия из каталога не применяется
+    """
+    signature = _directory_signature(directory)
+    changes = []
+    for name, _, _ in signature:
+        path = os.path.join(directory, name)
+        try:
+            with open(path, "rb") as f:
+                content = f.read()
+            document = json.loads(content.decode("utf-8"))
+            effective_from = _as_date(document["effective_from"])
+            sections = document["tariffs"]
+            unknown = set(sections) - set(TARIFF_DATA)
+            if unknown:
+                raise ValueError(f"неизвестные разделы {sorted(unknown)}")
+        except (OSError, KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Ошибка в файле тарифов {path}: {e}") from e
+        changes.append((effective_from, name[:-len(".json")], sections, content))
+
+    schedules = [TARIFFS]
+    data = TARIFF_DATA
+    content_hash = hashlib.sha1()
+    for effective_from, name, sections, content in sorted(changes, key=lambda change: change[0]):
+        data = {**data, **sections}
+        content_hash.update(content)
+        version = f"{name}@{content_hash.hexdigest()[:12]}"
+        try:
+            schedules.append(compile_schedule(data, version, effective_from))
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"Ошибка в версии тарифов {version}: {e!r}") from e
+    return ScheduleIndex(schedules, signature)
+
+
+def _initial_index():
+    try:
+        return load_schedules()
+    except ValueError as e:
+        print(f"{e}. Используются встроенные тарифы")
+        return ScheduleIndex([TARIFFS], _directory_signature(TARIFF_SCHEDULES_DIR))
+
+
+# Активный индекс версий; заменяется целиком (reload_schedules)
+_index = _initial_index()
+# Тарифы на сегодня: (индекс, набор, до какого момента time.time() он действует)
+_today = None
+_reload_lock = threading.Lock()
+_watcher_thread = None
+_watcher_stop = threading.Event()
+
+
+def get_schedule(on_date=None):
+    """Тарифы, действующие на дату декларирования on_date (по умолчанию сегодня)"""
+    if on_date is not None:
+        return _index.on(_as_date(on_date))
+    # date.today() заметно дороже расчета по скобкам, поэтому набор на сегодня
+    # запоминается до полуночи или до замены индекса
+    today = _today
+    if today is None or today[0] is not _index or time.time() >= today[2]:
+        today = _schedule_for_today()
+    return today[1]
+
+
+def _schedule_for_today():
+    global _today
+    index = _index
+    today = date.today()
+    midnight = datetime.combine(today + timedelta(days=1), datetime.min.time()).timestamp()
+    _today = (index, index.on(today), midnight)
+    return _today
+
+
+def get_schedule_index():
+    """Текущий индекс версий тарифов"""
+    return _index
+
+
+def reload_schedules(directory=TARIFF_SCHEDULES_DIR, force=False):
+    """
+    Перечитывает каталог версий, если он изменился, и атомарно подменяет индекс.
+
+    Расчеты, уже получившие набор тарифов, досчитываются по нему; кэши курсов
+    и карточек не затрагиваются, а кэш расчетов различает версии тарифов по
+    ключу. Если новый файл некорректен, остается прежний индекс.
+
+    :return: True, если индекс заменен
+    """
+    global _index
+    with _reload_lock:
+        if not force and _directory_signature(directory) == _index.signature:
+            return False
+        try:
+            index = load_schedules(directory)
+        except ValueError as e:
+            metrics.inc("customscalc_tariff_reloads_total", result="error")
+            print(f"{e}. Остаются прежние тарифы")
+            # Тот же некорректный каталог не перечитывается на каждой проверке
+            _index = ScheduleIndex(_index.schedules, _directory_signature(directory))
+            return False
+        _index = index
+        metrics.inc("customscalc_tariff_reloads_total", result="ok")
+        return True
+
+
+def _watcher_loop(check_interval):
+    while not _watcher_stop.wait(check_interval):
+        try:
+            reload_schedules()
+        except Exception as e:
+            print(f"Ошибка обновления тарифов: {e}")
+
+
+def start_schedule_watcher(check_interval=SCHEDULE_CHECK_INTERVAL):
+    """
+    Запускает поток, который подхватывает новые и измененные файлы тарифов без перезапуска.
+
+    Повторный вызов возвращает уже запущенный поток.
+    """
+    global _watcher_thread
+    with _reload_lock:
+        if _watcher_thread is not None and _watcher_thread.is_alive():
+            return _watcher_thread
+        _watcher_stop.clear()
+        _watcher_thread = threading.Thread(target=_watcher_loop, args=(check_interval,), name="tariff-watcher",
+                                           daemon=True)
+        _watcher_thread.start()
+        return _watcher_thread
+
+
+def stop_schedule_watcher():
+    """Останавливает поток обновления тарифов"""
+    _watcher_stop.set()
+
+
+def customs_duty(schedule, car_price_rub, engine_volume, car_age, is_electric, is_legal_entity, fuel_type,
+                 exchange_rate, to_eur):
+    """
+    Таможенная пошлина в рублях.
+
+    :param to_eur: Функция перевода рублей в евро (нужна только физлицам для авто младше 3 лет)
+    """
+    if is_electric:
+        return car_price_rub * schedule.electric_duty_rate
+
+    if not is_legal_entity:
+        tables = schedule.individual_duty
+        if car_age < 3:
+            rate, min_per_cm3 = tables["new"].lookup(to_eur(car_price_rub))
+            return max(car_price_rub * rate, min_per_cm3 * engine_volume * exchange_rate)
+        if 3 <= car_age <= 5:
+            return tables["3_5"].lookup(engine_volume) * engine_volume * exchange_rate
+        return tables["old"].lookup(engine_volume) * engine_volume * exchange_rate
+
+    fuel = LEGAL_FUEL_TABLES.get(fuel_type)
+    if fuel is None:
+        raise ValueError(f"Неизвестный тип топлива: {fuel_type}")
+    tables = schedule.legal_duty[fuel]
+    if car_age < 3:
+        return car_price_rub * tables["new"].lookup(engine_volume)
+    if 3 <= car_age <= 7:
+        rate, min_per_cm3 = tables["3_7"].lookup(engine_volume)
+        return max(car_price_rub * rate, min_per_cm3 * engine_volume * exchange_rate)
+    return tables["old"].lookup(engine_volume) * engine_volume * exchange_rate
+
+
+def duty_terms(schedule, price_eur, engine_volume, car_age, is_electric, is_legal_entity, fuel_type):
+    """
+    Пошлина в разложенном виде: max(цена в рублях * ставка, сумма в евро * курс евро).
+
+    Та же логика, что в customs_duty, но вместо суммы возвращает коэффициенты.
+
+    :param price_eur: Цена в евро (нужна только физлицам для авто младше 3 лет)
+    :return: (ставка от цены, сумма в евро, интервал цены в евро (lo, hi] для
+        скобки физлиц младше 3 лет или None)
+    """
+    if is_electric:
+        return schedule.electric_duty_rate, 0, None
+
+    if not is_legal_entity:
+        tables = schedule.individual_duty
+        if car_age < 3:
+            brackets = tables["new"]
+            i = brackets.index(price_eur)
+            rate, min_per_cm3 = brackets.values[i]
+            return rate, min_per_cm3 * engine_volume, brackets.interval(i)
+        if 3 <= car_age <= 5:
+            return 0, tables["3_5"].lookup(engine_volume) * engine_volume, None
+        return 0, tables["old"].lookup(engine_volume) * engine_volume, None
+
+    fuel = LEGAL_FUEL_TABLES.get(fuel_type)
+    if fuel is None:
+        raise ValueError(f"Неизвестный тип топлива: {fuel_type}")
+    tables = schedule.legal_duty[fuel]
+    if car_age < 3:
+        return tables["new"].lookup(engine_volume), 0, None
+    if 3 <= car_age <= 7:
+        rate, min_per_cm3 = tables["3_7"].lookup(engine_volume)
+        return rate, min_per_cm3 * engine_volume, None
+    return 0, tables["old"].lookup(engine_volume) * engine_volume, None
+
+
+def recycling_coefficient(schedule, engine_volume, car_age, is_electric, is_legal_entity, is_commercial):
+    """Коэффициент утилизационного сбора"""
+    tables = schedule.recycling["commercial" if is_commercial or is_legal_entity else "personal"]
+    if is_electric:
+        return tables["electric_new"] if car_age < 3 else tables["electric_old"]
+    return tables["new" if car_age < 3 else "old"].lookup(engine_volume)
+
+
+def compute_fees(schedule, car_price_rub, engine_volume, car_age, engine_power, is_electric, is_legal_entity,
+                 is_commercial, fuel_type, exchange_rate, to_eur):
+    """
+    Считает все сборы по набору тарифов.
+
+    :return: Кортеж (оформление, пошлина, утильсбор, акциз, НДС, итог)
+    """
+    # 1. Сбор за таможенное оформление
+    customs_clearance_fee = schedule.clearance_fee.lookup(car_price_rub)
+
+    # 2. Таможенная пошлина
+    duty = customs_duty(schedule, car_price_rub, engine_volume, car_age, is_electric, is_legal_entity, fuel_type,
+                        exchange_rate, to_eur)
+
+    # 3. Утилизационный сбор
+    base_rate = schedule.recycling_base["legal" if is_legal_entity else "individual"]
+    recycling_fee = base_rate * recycling_coefficient(schedule, engine_volume, car_age, is_electric,
+                                                      is_legal_entity, is_commercial)
+
+    # 4. Акциз и 5. НДС (для юридических лиц или физических лиц, если электромобиль)
+    if is_legal_entity or is_electric:
+        excise_tax = schedule.excise.lookup(engine_power) * engine_power
+        vat = (car_price_rub + duty + excise_tax) * schedule.vat_rate
+    else:
+        excise_tax = 0
+        vat = 0
+
+    # Итоговая стоимость растаможки
+    total_cost = customs_clearance_fee + duty + recycling_fee + excise_tax + vat
+    return customs_clearance_fee, duty, recycling_fee, excise_tax, vat, total_cost
@@ -0,0 +1,39 @@
+import json
+
+import pytest
+
+import quote_cache
+import tariffs
+from config import FEE_KEYS
+from quote_cache import QuoteCache, cached_customs_clearance
+
+
+def write_schedule(path, clearance_fee):
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"effective_from": "2025-01-01", "tariffs": {"clearance_fee": [[None, clearance_fee]]}}, f)
+
+
+@pytest.fixture
+def schedules_dir(tmp_path, monkeypatch):
+    # Курсы не нужны: курс евро передается явно
+    monkeypatch.setattr(quote_cache, "get_rate_snapshot", lambda: None)
+    monkeypatch.setattr(quote_cache, "get_snapshot_on", lambda on_date: None)
+    yield tmp_path
+    tariffs.reload_schedules(force=True)
+
+
+def test_cached_quote_follows_schedule_edited_in_place(schedules_dir):
+    path = schedules_dir / "2025-01.json"
+    write_schedule(path, 5555)
+    tariffs.reload_schedules(str(schedules_dir), force=True)
+    cache = QuoteCache()
+    args = (2_500_000, 1998, 4, 190, False, True)
+    kwargs = {"exchange_rate": 100, "on_date": "2025-06-01", "cache": cache}
+    assert cached_customs_clearance(*args, **kwargs)[FEE_KEYS[0]] == 5555
+    old_version = tariffs.get_schedule("2025-06-01").version
+
+    # Тот же файл и тот же размер - меняется только содержимое
+    write_schedule(path, 7777)
+    tariffs.reload_schedules(str(schedules_dir), force=True)
+    assert tariffs.get_schedule("2025-06-01").version != old_version
+    assert cached_customs_clearance(*args, **kwargs)[FEE_KEYS[0]] == 7777